@@ -18,9 +18,12 @@ from __future__ import print_function
 import argparse
 import sys
 import os
-import csv
-import bisect
+import mmap
+import re
 import textwrap
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "fasta_writer"))
+from fasta_writer import FastaWriter, open_fasta_output
 
 __author__ = "Amine Ghozlane"
 __copyright__ = "Copyright 2014, INRA"
@@ -31,6 +34,14 @@ __maintainer__ = "Amine Ghozlane"
 __email__ = "amine.ghozlane@jouy.inra.fr"
 __status__ = "Developpement"
 
+# Extension of the offset index written next to the catalogue
+INDEX_SUFFIX = ".fxi"
+# Line written after the stamp of the index of a catalogue that cannot be
+# indexed
+NOT_INDEXED = b"#not_indexed\t"
+# Header line of a fasta record, the name ends at the first space
+HEADER = re.compile(br"\n>([^ \r\n]*)[^\n]*")
+
 
 def isfile(path):
     """Check if path is an existing file.
@@ -61,6 +72,19 @@ def isdir(path):
     return path
 
 
+def list_output(value):
+    """Check a list of sequence given as list or list:output.
+      Arguments:
+          value: Argument of -i
+    """
+    if os.path.isfile(value):
+        return value, None
+    list_file, sep, output_file = value.rpartition(":")
+    if not sep or not output_file:
+        return isfile(value), None
+    return isfile(list_file), output_file
+
+
 def getArguments():
     """Retrieves the arguments of the program.
       Returns: An object that contains the arguments
@@ -69,36 +93,47 @@ def getArguments():
     parser = argparse.ArgumentParser(description=__doc__, usage=
                                      "{0} -h".format(sys.argv[0]))
     parser.set_defaults(results=".{0}".format(os.sep))
-    parser.add_argument('-i', dest='list_sequences_file', type=isfile,
-                        required=True,
-                        help='List of sequence to extract.')
+    parser.add_argument('-i', dest='list_sequences_files', type=list_output,
+                        action='append', required=True,
+                        help='List of sequence to extract, as list or '
+                        'list:output. Can be repeated to extract several '
+                        'lists in one pass over the catalogue.')
     parser.add_argument('-d', dest='catalogue_file', type=isfile,
                         required=True, help='Database query.')
     parser.add_argument('-n', dest='not_in_database', action='store_true',
                         help='Select instead elements which are not in the'
                         ' list.')
     parser.add_argument('-o', dest='output_file', type=str,
-                        help='Output file.')
+                        help='Output file of the list given without output.')
+    parser.add_argument('-x', dest='use_index', action='store_true',
+                        help='Read the sequences with an offset index of the '
+                        'catalogue ({0}), built next to it when it is missing '
+                        'or out of date.'.format(INDEX_SUFFIX))
     parser.add_argument('-r', dest='results', type=isdir,
                         help='Path to result directory.')
-    return parser.parse_args()
+    args = parser.parse_args()
+    if len([output_file for _, output_file in args.list_sequences_files
+            if not output_file]) > 1:
+        parser.error("only one list can be given without output")
+    return args
 
 
 def extract_interest_elements(list_sequences_file):
-    """Get a list of the element of interest
+    """Get the set of the element of interest, as bytes like the names of
+    the catalogue
     """
-    list_sequences = []
+    list_sequences = set()
     try:
-        with open(list_sequences_file, "rt") as list_seq:
-            list_sequences_reader = csv.reader(list_seq, delimiter="\t")
-            # Pass header
-            header = list_sequences_reader.next()
-            if header[0] != "OTU":
-                list_sequences.append(header[0])
-            for line in list_sequences_reader:
-                 list_sequences.append(line[0])
-            assert(list_sequences > 0)
-            list_sequences.sort()
+        with open(list_sequences_file, "rb") as list_seq:
+            for num, line in enumerate(list_seq):
+                line = line.rstrip(b"\r\n")
+                if not line:
+                    continue
+                name = line.split(b"\t")[0]
+                # Pass header
+                if num or name != b"OTU":
+                    list_sequences.add(name)
+            assert(len(list_sequences) > 0)
     except IOError:
         sys.exit("Error cannot the file : {0}".format(list_sequences_file))
     except AssertionError:
@@ -107,76 +142,332 @@ def extract_interest_elements(list_sequences_file):
     return list_sequences
 
 
-# def is_selected(header, list_sequences):
-#     """
-#     """
-#     for element in list_sequences:
-#         if element in header:
-#             return element
-#     return None
+def get_targets(list_sequences, not_in_database):
+    """Get the outputs of each sequence name
+      Arguments:
+          list_sequences: List of the sets of names (bytes) of each output
+          not_in_database: Select the names which are not in the sets
+      Returns: A dict of the names (bytes) to the tuple of their output
+               numbers, and the outputs of the names missing from the dict
+    """
+    outputs = tuple(range(len(list_sequences)))
+    targets = {}
+    for num, names in enumerate(list_sequences):
+        for name in names:
+            targets[name] = targets.get(name, ()) + (num,)
+    if not_in_database:
+        for name in targets:
+            targets[name] = tuple(num for num in outputs
+                                  if num not in targets[name])
+        return targets, outputs
+    return targets, ()
 
 
-def get_element(name, input_list):
-    """Search name in input list
+def open_outputs(output_files):
+    """Open a FastaWriter for each output file
+    """
+    outputs = []
+    try:
+        for output_file in output_files:
+            outputs.append(FastaWriter(open_fasta_output(output_file)))
+    except IOError:
+        close_outputs(outputs)
+        raise
+    return outputs
+
+
+def close_outputs(outputs):
+    """Close the FastaWriter of each output file
+    """
+    for output in outputs:
+        output.close()
+
+
+def check_extracted(nb_extracted, output_files, catalogue_file):
+    """Remove the outputs without sequence and stop in this case
+    """
+    empty = [output_file for output_file, count in zip(output_files,
+                                                       nb_extracted)
+             if not count]
+    if empty:
+        for output_file in empty:
+            os.remove(output_file)
+        sys.exit("Error no element detected in the file : {0} ({1})"
+                 .format(catalogue_file, ", ".join(empty)))
+
+
+def extract_catalogue_sequence(targets, default, catalogue_file,
+                               output_files):
+    """Write the selected sequences of the catalogue while it is read. The
+    catalogue is mapped in memory, only the selected records are copied.
+      Returns: The number of extracted sequences of each output
+    """
+    nb_extracted = [0] * len(output_files)
+    try:
+        outputs = open_outputs(output_files)
+        try:
+            with open(catalogue_file, "rb") as catalogue:
+                if os.fstat(catalogue.fileno()).st_size:
+                    data = mmap.mmap(catalogue.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+                    try:
+                        nb_extracted = scan_catalogue(data, targets, default,
+                                                      outputs)
+                    finally:
+                        data.close()
+        finally:
+            close_outputs(outputs)
+    except (IOError, OSError) as err:
+        sys.exit("Error cannot the file : {0}".format(err.filename))
+    check_extracted(nb_extracted, output_files, catalogue_file)
+    return nb_extracted
+
+
+def write_record(title, sequence, outputs, nums, nb_extracted):
+    """Write a record in the outputs numbered nums
+    """
+    sequence = sequence.replace(b"\n", b"").replace(b"\r", b"")
+    for num in nums:
+        outputs[num].write(title, sequence)
+        nb_extracted[num] += 1
+
+
+def scan_catalogue(data, targets, default, outputs):
+    """Write the selected records of a mapped fasta file
       Arguments:
-        input_list: List
-        name: Search criteria
+          data: Content of the catalogue (mmap or bytes)
+          targets: Dict of the names (bytes) to the tuple of their outputs
+          default: Outputs of the names missing from targets
+          outputs: List of FastaWriter
+      Returns: The number of extracted sequences of each output
+    """
+    nb_extracted = [0] * len(outputs)
+    title = None
+    nums = ()
+    sequence_start = 0
+    if data[:1] == b">":
+        # The first header does not follow a newline
+        header_end = data.find(b"\n")
+        if header_end < 0:
+            header_end = len(data)
+        title = data[1:header_end].rstrip(b"\r").split(b" ")[0]
+        nums = targets.get(title, default)
+        sequence_start = header_end
+    # Records end where the next header starts
+    for header in HEADER.finditer(data):
+        if nums:
+            write_record(title, data[sequence_start:header.start()], outputs,
+                         nums, nb_extracted)
+        title = header.group(1)
+        nums = targets.get(title, default)
+        sequence_start = header.end()
+    if nums:
+        write_record(title, data[sequence_start:], outputs, nums,
+                     nb_extracted)
+    return nb_extracted
+
+
+def native_str(name):
+    """Get a name (bytes) as a native string for the messages, the bytes
+    that are not UTF-8 are replaced
     """
-    # Searching the node with its name
-    i = bisect.bisect_left(input_list, name)
-    # Object has been found
-    if(i != len(input_list) and input_list[i] == name):
-        return True #input_list[i]
-    return False #None
+    if str is bytes:
+        return name
+    return name.decode("utf-8", "replace")
 
 
-def extract_catalogue_sequence(list_sequences, catalogue_file, not_in_database):
+def get_index_stamp(catalogue_file):
+    """Get the first line of the index, it identifies the catalogue version
     """
+    stat = os.stat(catalogue_file)
+    return "#fasta_index_by_name\t{0}\t{1:.6f}\n".format(
+        stat.st_size, stat.st_mtime).encode()
+
+
+def build_index(catalogue_file):
+    """Get the name, sequence length, offset of the sequence, bases per
+    line and bytes per line of each record (samtools faidx columns)
+      Returns: The stamp of the catalogue and the list of the records
+    """
+    entries = []
+    offset = 0
+    entry = None
+    last_line = False
+    stamp = get_index_stamp(catalogue_file)
+    with open(catalogue_file, "rb") as catalogue:
+        for line in catalogue:
+            offset += len(line)
+            if line.startswith(b">"):
+                title = line[1:].rstrip(b"\r\n").split(b" ")[0]
+                # name, length, offset, line bases, line width
+                entry = [title, 0, offset, 0, 0]
+                entries.append(entry)
+                last_line = False
+            elif entry is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if not bases:
+                    last_line = True
+                    continue
+                if last_line:
+                    raise ValueError("different line length in {0}"
+                                     .format(native_str(entry[0])))
+                if not entry[3]:
+                    entry[3] = bases
+                    entry[4] = len(line)
+                elif bases > entry[3] or (bases == entry[3] and
+                                          len(line) != entry[4]):
+                    raise ValueError("different line length in {0}"
+                                     .format(native_str(entry[0])))
+                # Only the last line of a record can be shorter
+                last_line = bases < entry[3]
+                entry[1] += bases
+    return stamp, entries
+
+
+def write_index(catalogue_file, index_file):
+    """Build and write the index of the catalogue, sorted by name. The
+    failure is written instead for a catalogue that cannot be indexed, so
+    that it is not indexed again until it changes.
     """
-    grab_sequence = False
-    interest_sequence = {}
-    title = ""
     try:
-        with open(catalogue_file, "rt") as catalogue:
-            for line in catalogue:
-                if line[0] == ">":
-                    grab_sequence = False
-                    title = line[1:].replace("\n", "").replace("\r", "")
-                    if " " in title:
-                        title = title.split(" ")[0]
-                    selection = get_element(title, list_sequences)
-                    if selection and not not_in_database:
-                        interest_sequence[title] = ""
-                        grab_sequence = True
-                    elif not selection and not_in_database:
-                        interest_sequence[title] = ""
-                        grab_sequence = True
-                elif grab_sequence and len(line) > 0:
-                    interest_sequence[title] += line.replace("\n", "").replace("\r", "")
-            assert(len(interest_sequence) > 0)
-    except IOError:
-        sys.exit("Error cannot the file : {0}".format(catalogue_file))
-    except AssertionError:
-        sys.exit("Error no element detected in the file : {0}"
-                 .format(catalogue_file))
-    return interest_sequence
+        stamp, entries = build_index(catalogue_file)
+        entries.sort()
+        lines = [b"\t".join([entry[0]] + [str(value).encode()
+                                          for value in entry[1:]]) + b"\n"
+                 for entry in entries]
+    except ValueError as err:
+        stamp = get_index_stamp(catalogue_file)
+        message = str(err)
+        if not isinstance(message, bytes):
+            message = message.encode("utf-8")
+        lines = [NOT_INDEXED + message + b"\n"]
+    tmp_file = index_file + ".tmp"
+    with open(tmp_file, "wb") as index:
+        index.write(stamp)
+        index.writelines(lines)
+    os.rename(tmp_file, index_file)
 
 
-def fill(text, width=80):
-    """Split text"""
-    return os.linesep.join(text[i:i+width] for i in xrange(0, len(text), width))
+def read_index(catalogue_file, index_file):
+    """Map an index in memory
+      Returns: The mapped index and the offset of its first record, or None
+               if the index does not match the catalogue
+      Raises: ValueError if the catalogue cannot be indexed
+    """
+    with open(index_file, "rb") as index:
+        stamp = index.readline()
+        if stamp != get_index_stamp(catalogue_file):
+            return None
+        line = index.readline()
+        if line.startswith(NOT_INDEXED):
+            raise ValueError(native_str(
+                line[len(NOT_INDEXED):].rstrip(b"\n")))
+        data = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+    return data, len(stamp)
+
+
+def get_index(catalogue_file):
+    """Load the index of the catalogue, build it if needed
+    """
+    index_file = catalogue_file + INDEX_SUFFIX
+    index = None
+    if os.path.isfile(index_file):
+        index = read_index(catalogue_file, index_file)
+    if index is None:
+        print("Index the catalogue in {0}...".format(index_file))
+        write_index(catalogue_file, index_file)
+        index = read_index(catalogue_file, index_file)
+    return index
 
 
-def write_interest_sequence(interest_sequence, output_file):
+def parse_entry(line):
+    """Get the name (bytes), sequence length, offset, line bases and line
+    width of a line of the index
     """
+    # Names can contain tabulations
+    name, length, offset, bases, width = line.rstrip(b"\n").rsplit(b"\t", 4)
+    return name, int(length), int(offset), int(bases), int(width)
+
+
+def find_entries(data, start, name):
+    """Get the records of a name by bisection of the index
+      Arguments:
+          data: Content of the index (mmap or bytes)
+          start: Offset of the first record
+          name: Name of the sequence (bytes)
+      Returns: A list of (name, length, offset, line bases, line width)
     """
+    low = start
+    high = len(data)
+    # First line whose name is not lower than name
+    while low < high:
+        line_start = max(data.rfind(b"\n", 0, (low + high) // 2) + 1, low)
+        line_end = data.find(b"\n", line_start) + 1 or len(data)
+        if data[line_start:line_end].rsplit(b"\t", 4)[0] < name:
+            low = line_end
+        else:
+            high = line_start
+    entries = []
+    while low < len(data):
+        line_end = data.find(b"\n", low) + 1 or len(data)
+        entry = parse_entry(data[low:line_end])
+        if entry[0] != name:
+            break
+        entries.append(entry)
+        low = line_end
+    return entries
+
+
+def read_entries(data, start):
+    """Get all the records of the index
+      Arguments:
+          data: Content of the index (mmap or bytes)
+          start: Offset of the first record
+      Returns: A list of (name, length, offset, line bases, line width)
+    """
+    return [parse_entry(line)
+            for line in data[start:].split(b"\n") if line]
+
+
+def extract_indexed_sequence(targets, default, catalogue_file, output_files,
+                             data, start):
+    """Write the selected sequences of the catalogue by seeking to each
+    of them with the index. Only the records of the targets are looked up,
+    unless the names missing from them are selected too.
+      Returns: The number of extracted sequences of each output
+    """
+    nb_extracted = [0] * len(output_files)
+    if default:
+        entries = read_entries(data, start)
+    else:
+        entries = []
+        for name in targets:
+            entries.extend(find_entries(data, start, name))
+    # Write the records in the order of the catalogue
+    entries.sort(key=lambda entry: entry[2])
     try:
-        with open(output_file, "wt") as output:
-            for key in interest_sequence:
-                output.write(">{1}{0}{2}{0}".format(
-                                os.linesep, key, fill(interest_sequence[key])))
-    except IOError:
-        sys.exit("Error cannot open {0}".format(output_file))
+        outputs = open_outputs(output_files)
+        try:
+            with open(catalogue_file, "rb") as catalogue:
+                for title, length, offset, bases, width in entries:
+                    nums = targets.get(title, default)
+                    if not nums:
+                        continue
+                    sequence = b""
+                    if length:
+                        # Bytes of the full lines plus the last line
+                        lines = (length - 1) // bases
+                        catalogue.seek(offset)
+                        sequence = catalogue.read(lines * width + length -
+                                                  lines * bases)
+                    write_record(title, sequence, outputs, nums,
+                                 nb_extracted)
+        finally:
+            close_outputs(outputs)
+    except IOError as err:
+        sys.exit("Error cannot the file : {0}".format(err.filename))
+    check_extracted(nb_extracted, output_files, catalogue_file)
+    return nb_extracted
 
 
 #==============================================================
@@ -188,21 +479,43 @@ def main():
     """
     # Get the arguments
     args = getArguments()
-    # Get List of sequence of interest
-    print("Load the list of sequence of interest ...")
-    list_sequences = extract_interest_elements(args.list_sequences_file)
-    print("{0} sequences to search".format(len(list_sequences)))
-    # Extract catalogue sequence
-    print("Extract sequences from the catalogue...")
-    interest_sequence = extract_catalogue_sequence(list_sequences,
-                                                   args.catalogue_file,
-                                                   args.not_in_database)
-    print("{0} extracted sequences".format(len(interest_sequence)))
-    # Write sequences
     if not args.output_file:
        args.output_file = "extracted_sequence.fasta"
-    print("Write sequences to {0}".format(args.output_file))
-    write_interest_sequence(interest_sequence, args.output_file)
+    output_files = [output_file or args.output_file
+                    for _, output_file in args.list_sequences_files]
+    # Get List of sequence of interest
+    print("Load the list of sequence of interest ...")
+    list_sequences = []
+    for list_sequences_file, _ in args.list_sequences_files:
+        list_sequences.append(extract_interest_elements(list_sequences_file))
+        print("{0} sequences to search in {1}".format(
+            len(list_sequences[-1]), list_sequences_file))
+    targets, default = get_targets(list_sequences, args.not_in_database)
+    # Extract catalogue sequence and write them
+    print("Extract sequences from the catalogue to {0}..."
+          .format(", ".join(output_files)))
+    index = None
+    if args.use_index:
+        try:
+            index = get_index(args.catalogue_file)
+        except (IOError, OSError, ValueError) as err:
+            print("Cannot index the catalogue ({0}), read it entirely"
+                  .format(err))
+    if index is not None:
+        data, start = index
+        try:
+            nb_extracted = extract_indexed_sequence(targets, default,
+                                                    args.catalogue_file,
+                                                    output_files, data,
+                                                    start)
+        finally:
+            data.close()
+    else:
+        nb_extracted = extract_catalogue_sequence(targets, default,
+                                                  args.catalogue_file,
+                                                  output_files)
+    for output_file, count in zip(output_files, nb_extracted):
+        print("{0} extracted sequences in {1}".format(count, output_file))
     print("Done.")
 
 
@@ -20,7 +20,11 @@ import csv
 import glob
 import re
 import gzip
+import collections
 from itertools import chain
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "fastq2fasta"))
+from fastq2fasta import get_stats_file
 
 __author__ = "Amine Ghozlane"
 __copyright__ = "Copyright 2015, Institut Pasteur"
@@ -145,6 +149,45 @@ def parse_fastq(fastq_file):
     return seq_len_tab
 
 
+def parse_stats(stats_file):
+    """Get the read length histogram written by fastq2fasta --stats
+    """
+    length_dict = {}
+    try:
+        with open(stats_file, "rt") as stats:
+            for line in stats:
+                if line.startswith("#") or line.startswith("length"):
+                    continue
+                length, reads = line.split("\t")
+                length_dict[int(length)] = int(reads)
+    except (IOError, ValueError):
+        sys.exit("Error cannot parse {0}".format(stats_file))
+    return length_dict
+
+
+def get_reads_info(fastq_file):
+    """Get number, mean length and median length of the reads, from the
+    statistics of fastq2fasta if they are up to date, from the fastq file
+    otherwise.
+    """
+    stats_file = get_stats_file(fastq_file)
+    if (os.path.isfile(stats_file) and os.path.getmtime(stats_file) >=
+            os.path.getmtime(fastq_file)):
+        length_dict = parse_stats(stats_file)
+    else:
+        # parse_fastq counts the newline of the sequences
+        length_dict = collections.Counter(
+            length - 1 for length in parse_fastq(fastq_file))
+    nb_reads = sum(length_dict.values())
+    total = sum((length + 1) * length_dict[length] for length in length_dict)
+    seen = 0
+    for length in sorted(length_dict):
+        seen += length_dict[length]
+        if seen > nb_reads // 2:
+            break
+    return [nb_reads, total/nb_reads, length + 1]
+
+
 def parse_fasta(fasta_file, tag=";size=.+"):
     """Parse fasta sequence
     """
@@ -194,17 +237,17 @@ def get_reads_data(sample_read, list_reads, paired, tag):
             name = name.replace("-R1","").replace("_R1_001","")
             name = name.replace("_R1","")
             name = name.replace("_alien_f_filt","")
-            seq_len_tab_fwd = parse_fastq(list_reads[0][i])
-            seq_len_tab_rev = parse_fastq(list_reads[1][i])
+            info_fwd = get_reads_info(list_reads[0][i])
+            info_rev = get_reads_info(list_reads[1][i])
             #print(name)
             if name in sample_read:
                 #print("here")
-                sample_read[name].update({tag+"_fwd":get_size_info(seq_len_tab_fwd)})
-                sample_read[name].update({tag+"_rev":get_size_info(seq_len_tab_rev)})
+                sample_read[name].update({tag+"_fwd":info_fwd})
+                sample_read[name].update({tag+"_rev":info_rev})
             else:
                 #print("here2")
-                sample_read[name] = {tag+"_fwd":get_size_info(seq_len_tab_fwd)}
-                sample_read[name].update({tag+"_rev":get_size_info(seq_len_tab_rev)})
+                sample_read[name] = {tag+"_fwd":info_fwd}
+                sample_read[name].update({tag+"_rev":info_rev})
     else:
         for sample in list_reads:
             name,ext = os.path.splitext(os.path.basename(sample))
@@ -212,12 +255,12 @@ def get_reads_data(sample_read, list_reads, paired, tag):
             if ext == ".gz":
                 name = os.path.splitext(name)[0]
             name = name.replace("_alien_filt","")
-            seq_len_tab = parse_fastq(sample)
+            info = get_reads_info(sample)
             if name in sample_read:
-                sample_read[name].update({tag:get_size_info(seq_len_tab)})
+                sample_read[name].update({tag:info})
             else:
                 #print(seq_len_tab)
-                sample_read[name] = {tag:get_size_info(seq_len_tab)}
+                sample_read[name] = {tag:info}
     return sample_read
 
 
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    A copy of the GNU General Public License is available at
+#    http://www.gnu.org/licenses/gpl-3.0.html
+
+"""Compare the line based fasta rewriting of rename_otu with FastaWriter on
+a generated OTU file."""
+from __future__ import print_function
+import os
+import sys
+import argparse
+import random
+import tempfile
+import time
+from fasta_writer import FastaWriter, open_fasta_output, read_fasta
+
+
+def getArguments():
+    """Retrieves the arguments of the program.
+      Returns: An object that contains the arguments
+    """
+    # Parsing arguments
+    parser = argparse.ArgumentParser(description=__doc__, usage=
+                                     "{0} -h".format(sys.argv[0]))
+    parser.add_argument('-n', dest='nb_records', type=int, default=1000000,
+                        help='Number of OTU (default = 1000000).')
+    parser.add_argument('-w', dest='width', type=int, default=80,
+                        help='Line length of the generated file '
+                        '(default = 80).')
+    args = parser.parse_args()
+    return args
+
+
+def write_otu(fasta_file, nb_records, width):
+    """Generate an OTU file with sequences of 250 to 450 nucleotides."""
+    random.seed(0)
+    pool = "".join(random.choice("ACGT") for _ in range(4096))
+    with open(fasta_file, "wt") as fasta:
+        for num in range(nb_records):
+            start = random.randint(0, 3500)
+            sequence = pool[start:start + random.randint(250, 450)]
+            fasta.write(">{0};size={1};\n".format(num, nb_records - num))
+            for i in range(0, len(sequence), width):
+                fasta.write(sequence[i:i + width] + "\n")
+
+
+def fill(text, width=80):
+    """Split text"""
+    return os.linesep.join(text[i:i+width] for i in range(0, len(text), width))
+
+
+def rename_lines(fasta_file, output_file):
+    """Previous rename_otu implementation."""
+    count = 1
+    header = ""
+    sequence = ""
+    with open(output_file, "wt") as output:
+        with open(fasta_file, "rt") as fast:
+            for line in fast:
+                if line.startswith(">"):
+                    if len(header) > 0:
+                        print(">{0}{1}{2}{3}".format("OTU_", count, os.linesep,
+                                                     fill(sequence)),
+                              file=output)
+                        sequence = ""
+                        count += 1
+                    header = line
+                else:
+                    sequence += line.replace("\n", "").replace("\r", "")
+            print(">{0}{1}{2}{3}".format("OTU_", count, os.linesep,
+                                         fill(sequence)), file=output)
+
+
+def rename_writer(fasta_file, output_file):
+    """rename_otu implementation with FastaWriter."""
+    with FastaWriter(open_fasta_output(output_file)) as output:
+        with open(fasta_file, "rb") as fast:
+            for count, (_, sequence) in enumerate(read_fasta(fast), 1):
+                output.write("OTU_{0}".format(count).encode(), sequence)
+
+
+def main():
+    """Main program
+    """
+    args = getArguments()
+    tmp_dir = tempfile.mkdtemp()
+    fasta_file = os.path.join(tmp_dir, "otu.fasta")
+    write_otu(fasta_file, args.nb_records, args.width)
+    print("{0} OTU, {1:.1f} MB".format(
+        args.nb_records, os.path.getsize(fasta_file) / 1e6))
+    timings = []
+    for name, function in (("line based", rename_lines),
+                           ("FastaWriter", rename_writer)):
+        output_file = os.path.join(tmp_dir, name.replace(" ", "_") + ".fasta")
+        start = time.time()
+        function(fasta_file, output_file)
+        timings.append(time.time() - start)
+        print("{0}: {1:.2f} s".format(name, timings[-1]))
+    with open(os.path.join(tmp_dir, "line_based.fasta"), "rb") as old:
+        with open(os.path.join(tmp_dir, "FastaWriter.fasta"), "rb") as new:
+            identical = old.read() == new.read()
+    print("Speedup: {0:.2f}x, identical outputs: {1}".format(
+        timings[0] / timings[1], identical))
+    for name in os.listdir(tmp_dir):
+        os.remove(os.path.join(tmp_dir, name))
+    os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    A copy of the GNU General Public License is available at
+#    http://www.gnu.org/licenses/gpl-3.0.html
+
+"""Read and write fasta files by blocks, shared by rename_otu and
+extract_fasta."""
+from __future__ import print_function
+import os
+import sys
+
+__author__ = "Amine Ghozlane"
+__copyright__ = "Copyright 2015, Institut Pasteur"
+__credits__ = ["Amine Ghozlane"]
+__license__ = "GPL"
+__version__ = "1.0.0"
+__maintainer__ = "Amine Ghozlane"
+__email__ = "amine.ghozlane@pasteur.fr"
+__status__ = "Developpement"
+
+
+# Amount of data buffered before each write
+BUFFER_SIZE = 1 << 20
+# Number of bytes parsed at once
+BLOCK_SIZE = 8 << 20
+LINESEP = os.linesep.encode()
+
+
+def open_fasta_output(output_file):
+    """Open a file for binary writing.
+      Arguments:
+          output_file: Path to the file, standard output if None
+    """
+    if not output_file:
+        return getattr(sys.stdout, "buffer", sys.stdout)
+    return open(output_file, "wb")
+
+
+class FastaWriter(object):
+    """Write wrapped fasta records through a large buffer.
+      Arguments:
+          handle: Binary file object
+          width: Length of the sequence lines, no wrapping if 0
+          buffer_size: Amount of data buffered before each write
+    """
+    def __init__(self, handle, width=80, buffer_size=BUFFER_SIZE):
+        self.handle = handle
+        self.width = width
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def write(self, header, sequence):
+        """Write a record.
+          Arguments:
+              header: Header without ">" (bytes)
+              sequence: Sequence as bytes, bytearray or memoryview
+        """
+        buf = self.buffer
+        buf += b">"
+        buf += header
+        buf += LINESEP
+        width = self.width
+        length = len(sequence)
+        if not width or length <= width:
+            # An empty sequence still gets its (empty) line
+            buf += sequence
+            buf += LINESEP
+        else:
+            for start in range(0, length, width):
+                buf += sequence[start:start + width]
+                buf += LINESEP
+        if len(buf) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records."""
+        if self.buffer:
+            self.handle.write(self.buffer)
+            self.buffer = bytearray()
+
+    def close(self):
+        """Write the buffered records and close the file, the standard
+        output is only flushed."""
+        self.flush()
+        if self.handle in (sys.stdout, getattr(sys.stdout, "buffer", None)):
+            self.handle.flush()
+        else:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_fasta(handle, size=BLOCK_SIZE):
+    """Read the records of a fasta file by blocks.
+      Arguments:
+          handle: Binary file object
+          size: Number of bytes read at once
+      Returns: An iterator over (header line without ">", sequence)
+    """
+    tail = b""
+    block = handle.read(size)
+    while block:
+        data = tail + block
+        if b"\r" in data:
+            data = data.replace(b"\r", b"")
+        records = data.split(b"\n>")
+        # The last record can continue in the next block
+        tail = records.pop()
+        for record in records:
+            yield split_record(record)
+        block = handle.read(size)
+    if tail.strip():
+        yield split_record(tail)
+
+
+def split_record(record):
+    """Get the header and the sequence of a fasta record.
+      Arguments:
+          record: Text of the record, with or without the leading ">"
+    """
+    if record.startswith(b">"):
+        record = record[1:]
+    header, _, sequence = record.partition(b"\n")
+    return header, sequence.replace(b"\n", b"")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    A copy of the GNU General Public License is available at
+#    http://www.gnu.org/licenses/gpl-3.0.html
+
+"""Regression tests of fasta_writer."""
+import io
+import unittest
+from fasta_writer import FastaWriter, LINESEP, read_fasta
+
+
+def write_records(records, width=80):
+    """Write records with FastaWriter and return the output."""
+    handle = io.BytesIO()
+    writer = FastaWriter(handle, width)
+    for header, sequence in records:
+        writer.write(header, sequence)
+    writer.flush()
+    return handle.getvalue()
+
+
+class TestFastaWriter(unittest.TestCase):
+    """Output of FastaWriter compared with the former print based writers.
+    """
+    def test_empty_sequence(self):
+        self.assertEqual(write_records([(b"empty", b"")]),
+                         b">empty" + LINESEP + LINESEP)
+
+    def test_empty_sequence_without_wrapping(self):
+        self.assertEqual(write_records([(b"empty", b"")], 0),
+                         b">empty" + LINESEP + LINESEP)
+
+    def test_wrapping(self):
+        self.assertEqual(write_records([(b"read", b"ACGTACG")], 3),
+                         LINESEP.join([b">read", b"ACG", b"TAC", b"G", b""]))
+
+    def test_read_back(self):
+        records = [(b"first", b"ACGT" * 50), (b"empty", b""),
+                   (b"last", b"GG")]
+        output = write_records(records).replace(b"\r", b"")
+        self.assertEqual(list(read_fasta(io.BytesIO(output), 16)), records)
+
+
+if __name__ == '__main__':
+    unittest.main()
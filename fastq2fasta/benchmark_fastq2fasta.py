@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    A copy of the GNU General Public License is available at
+#    http://www.gnu.org/licenses/gpl-3.0.html
+
+"""Compare the line based fastq conversion of the former fastq2fasta with
+the block parser on a generated fastq file."""
+from __future__ import print_function
+import os
+import sys
+import argparse
+import random
+import tempfile
+import time
+import fastq2fasta
+
+
+def getArguments():
+    """Retrieves the arguments of the program.
+      Returns: An object that contains the arguments
+    """
+    # Parsing arguments
+    parser = argparse.ArgumentParser(description=__doc__, usage=
+                                     "{0} -h".format(sys.argv[0]))
+    parser.add_argument('-n', dest='nb_reads', type=int, default=200000,
+                        help='Number of reads (default = 200000).')
+    parser.add_argument('-l', dest='length', type=int, default=180,
+                        help='Mean read length (default = 180).')
+    parser.add_argument('-r', dest='repeat', type=int, default=3,
+                        help='Number of runs, the best one is kept '
+                        '(default = 3).')
+    args = parser.parse_args()
+    return args
+
+
+def write_reads(fastq_file, nb_reads, length):
+    """Generate a fastq file with Illumina like headers."""
+    random.seed(0)
+    pool = "".join(random.choice("ACGT") for _ in range(4096))
+    with open(fastq_file, "wt") as fastq:
+        for num in range(nb_reads):
+            start = random.randint(0, 4096 - length - 10)
+            sequence = pool[start:start + random.randint(length - 10,
+                                                         length + 10)]
+            fastq.write("@M00001:1:FC:1:{0}:{1}:{2} 1:N:0:1\n{3}\n+\n{4}\n"
+                        .format(num % 100, num, 3 * num, sequence,
+                                "I" * len(sequence)))
+
+
+def convert_lines(fastq_file, output_file, sample_name):
+    """Previous fastq2fasta implementation."""
+    with open(output_file, "wt") as output:
+        with open(fastq_file, "rt") as fastq:
+            for line in fastq:
+                header = line[1:].split(" ")[0]
+                line = next(fastq)
+                print(">{0};barcodelabel={2}\n{1}".format(
+                    header[1:].replace("\n", ""), line.replace("\n", ""),
+                    sample_name), file=output)
+                next(fastq)
+                next(fastq)
+
+
+def convert_blocks(fastq_file, output_file, sample_name):
+    """fastq2fasta implementation with the block parser."""
+    fastq2fasta.convert_fastq_fasta(fastq_file, sample_name, output_file)
+
+
+def main():
+    """Main program
+    """
+    args = getArguments()
+    tmp_dir = tempfile.mkdtemp()
+    fastq_file = os.path.join(tmp_dir, "reads.fastq")
+    write_reads(fastq_file, args.nb_reads, args.length)
+    size = os.path.getsize(fastq_file) / 1e6
+    print("Python {0}, {1} reads, {2:.1f} MB".format(
+        sys.version.split()[0], args.nb_reads, size))
+    timings = []
+    for name, function in (("line based", convert_lines),
+                           ("block parser", convert_blocks)):
+        output_file = os.path.join(tmp_dir, name.replace(" ", "_") + ".fasta")
+        best = None
+        for _ in range(args.repeat):
+            start = time.time()
+            function(fastq_file, output_file, "sample")
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings.append(best)
+        print("{0}: {1:.2f} s ({2:.0f} MB/s)".format(name, best, size / best))
+    with open(os.path.join(tmp_dir, "line_based.fasta"), "rb") as old:
+        with open(os.path.join(tmp_dir, "block_parser.fasta"), "rb") as new:
+            identical = old.read() == new.read()
+    print("Speedup: {0:.2f}x, identical outputs: {1}".format(
+        timings[0] / timings[1], identical))
+    for name in os.listdir(tmp_dir):
+        os.remove(os.path.join(tmp_dir, name))
+    os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
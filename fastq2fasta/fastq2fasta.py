@@ -14,6 +14,41 @@ from __future__ import print_function
 import os
 import sys
 import argparse
+import collections
+import glob
+import io
+import multiprocessing
+import struct
+import threading
+import zlib
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Size of the compressed chunks read by the decompression thread
+READ_SIZE = 1 << 20
+# Size of the blocks of reads parsed at once
+BLOCK_SIZE = 8 << 20
+# Size of the parts of the file converted by each process
+CHUNK_SIZE = 32 << 20
+# Maximum amount of uncompressed data stored in one BGZF block
+BGZF_BLOCK_SIZE = 0xff00
+# Empty BGZF block marking the end of the file
+BGZF_EOF = (b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43"
+            b"\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
 
 
 def isfile(path):
@@ -37,48 +72,1135 @@ def getArguments():
     # Parsing arguments
     parser = argparse.ArgumentParser(description=__doc__, usage=
                                      "{0} -h".format(sys.argv[0]))
-    parser.add_argument('-i', dest='fastq_file', type=isfile, required=True,
-                        help='Path to the fastq file.')
+    parser.add_argument('-i', dest='fastq_file', type=isfile, default=None,
+                        help='Path to the fastq file (plain, gzip, bgzip or '
+                        'zstd compressed).')
     parser.add_argument('-s', dest='sample_name', type=str, default="",
                         help='Add sample to the reads for usearch pipeline.')
     parser.add_argument('-o', dest='output_file', type=str, default=None,
-                        help='Output file.')
+                        help='Output file (compressed with bgzip if it ends '
+                        'with .gz or .bgz, with zstd if it ends with .zst). '
+                        'Output directory with -g (default = .).')
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        default=1, help='Number of processes used to convert '
+                        'plain and bgzip files, or the samples of a batch '
+                        '(default = 1).')
+    parser.add_argument('-m', dest='manifest_file', type=isfile, default=None,
+                        help='Batch mode: tabulated file with the fastq file, '
+                        'the sample name and the output file of each sample.')
+    parser.add_argument('-g', dest='pattern', type=str, default=None,
+                        help='Batch mode: glob pattern of the fastq files '
+                        '(quoted), samples are named after the files.')
+    parser.add_argument('-a', dest='amplicon_file', type=str, default=None,
+                        help='Batch mode: write also all the samples in this '
+                        'file, in the batch order.')
+    parser.add_argument('--stats', dest='stats', action='store_true',
+                        default=False, help='Write the number of reads, the '
+                        'read length histogram, mean, median and N50 next to '
+                        'each fastq file (<fastq>.stats).')
+    parser.add_argument('--maxee', dest='max_ee', type=float, default=None,
+                        help='Discard the reads with more expected errors '
+                        '(sum of the error probabilities of the quality '
+                        'scores).')
+    parser.add_argument('--minlen', dest='min_length', type=int, default=0,
+                        help='Discard the reads shorter than this length '
+                        '(default = 0).')
+    parser.add_argument('--maxns', dest='max_ns', type=int, default=None,
+                        help='Discard the reads with more N.')
+    parser.add_argument('--ascii', dest='offset', type=int, default=33,
+                        help='ASCII offset of the quality scores '
+                        '(default = 33).')
+    parser.add_argument('--derep', dest='dereplicate', action='store_true',
+                        default=False, help='Write the unique sequences of '
+                        'each sample with their abundance (;size=N;) by '
+                        'decreasing abundance instead of every read.')
     args = parser.parse_args()
+    if [args.fastq_file, args.manifest_file, args.pattern].count(None) != 2:
+        parser.error("one of the arguments -i, -m or -g is required")
     return args
 
 
-def convert_fastq_fasta(fastq_file, sample_name, output_file):
+def is_bgzf(header):
+    """Check if a gzip header is the header of a BGZF block.
+      Arguments:
+          header: First bytes of the file
+    """
+    return (len(header) >= 18 and header[3:4] == b"\x04"
+            and header[10:12] == b"\x06\x00" and header[12:14] == b"BC")
+
+
+def read_gzip(handle, size=READ_SIZE):
+    """Decompress a gzip file, possibly made of several members.
+      Arguments:
+          handle: Binary file object of the compressed data
+          size: Size of the compressed chunks
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = handle.read(size)
+    while data:
+        block = decompressor.decompress(data)
+        if block:
+            yield block
+        data = decompressor.unused_data
+        if data:
+            # A new member starts
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            data = handle.read(size)
+    block = decompressor.flush()
+    if block:
+        yield block
+
+
+def read_bgzf_blocks(handle, offset=0, size=READ_SIZE):
+    """Decompress a BGZF file block by block.
+      Arguments:
+          handle: Binary file object of the compressed data
+          offset: Position of handle in the file
+          size: Size of the compressed chunks
+      Returns: An iterator over (block position, uncompressed data)
+    """
+    data = b""
+    pos = 0
+    while True:
+        if len(data) - pos >= 18:
+            block_size = struct.unpack_from("<H", data, pos + 16)[0] + 1
+            if len(data) - pos >= block_size:
+                block = zlib.decompress(data[pos + 18:pos + block_size - 8],
+                                        -zlib.MAX_WBITS)
+                yield offset, block
+                offset += block_size
+                pos += block_size
+                continue
+        chunk = handle.read(size)
+        if not chunk:
+            break
+        data = data[pos:] + chunk
+        pos = 0
+    if pos < len(data):
+        raise IOError("Truncated BGZF block")
+
+
+def read_bgzf(handle, size=READ_SIZE):
+    """Decompress a BGZF file.
+      Arguments:
+          handle: Binary file object of the compressed data
+          size: Size of the compressed chunks
+    """
+    for _, block in read_bgzf_blocks(handle, size=size):
+        if block:
+            yield block
+
+
+def read_zstd(handle, size=READ_SIZE):
+    """Decompress a zstd file.
+      Arguments:
+          handle: Binary file object of the compressed data
+          size: Size of the decompressed chunks
+    """
+    decompressor = zstandard.ZstdDecompressor()
+    try:
+        reader = decompressor.stream_reader(handle, read_size=size,
+                                            read_across_frames=True)
+    except TypeError:
+        reader = decompressor.stream_reader(handle, read_size=size)
+    block = reader.read(size)
+    while block:
+        yield block
+        block = reader.read(size)
+
+
+class ThreadedReader(object):
+    """Read-only file object filled by a decompression thread.
+      Arguments:
+          handle: Binary file object of the compressed data
+          blocks: Iterator over the decompressed blocks of handle
+          max_queue: Maximum number of decompressed chunks waiting
+    """
+    def __init__(self, handle, blocks, max_queue=8):
+        self.handle = handle
+        self.queue = queue.Queue(max_queue)
+        self.buffer = b""
+        self.eof = False
+        self.error = None
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._fill, args=(blocks,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self, blocks):
+        """Decompress the file and queue chunks of READ_SIZE bytes."""
+        pending = []
+        length = 0
+        try:
+            for block in blocks:
+                if self.stop.is_set():
+                    break
+                pending.append(block)
+                length += len(block)
+                if length >= READ_SIZE:
+                    self.queue.put(b"".join(pending))
+                    pending = []
+                    length = 0
+            if pending:
+                self.queue.put(b"".join(pending))
+        except (IOError, zlib.error) as err:
+            self.error = err
+        except Exception as err:
+            self.error = IOError(str(err))
+        self.queue.put(None)
+
+    def read(self, size=-1):
+        """Read at most size bytes, all the file if size is negative."""
+        pieces = [self.buffer]
+        length = len(self.buffer)
+        while (size < 0 or length < size) and not self.eof:
+            block = self.queue.get()
+            if block is None:
+                self.eof = True
+                if self.error:
+                    raise self.error
+                break
+            pieces.append(block)
+            length += len(block)
+        data = b"".join(pieces)
+        if size >= 0:
+            self.buffer = data[size:]
+            data = data[:size]
+        else:
+            self.buffer = b""
+        return data
+
+    def close(self):
+        """Stop the decompression thread and close the file."""
+        self.stop.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                self.thread.join(0.01)
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def compress_bgzf(data, level=6):
+    """Compress data in one BGZF block.
+      Arguments:
+          data: At most BGZF_BLOCK_SIZE bytes
+          level: Compression level
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    payload = compressor.compress(data) + compressor.flush()
+    return b"".join((
+        struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                    len(payload) + 25),
+        payload,
+        struct.pack("<2I", zlib.crc32(data) & 0xffffffff, len(data))))
+
+
+class ThreadedWriter(object):
+    """Write-only file object compressed by a background thread.
+      Arguments:
+          handle: Binary file object receiving the compressed data
+          compression: "bgzf" or "zstd"
+          max_queue: Maximum number of chunks waiting for compression
+    """
+    def __init__(self, handle, compression, max_queue=8):
+        self.handle = handle
+        self.queue = queue.Queue(max_queue)
+        self.pending = []
+        self.length = 0
+        self.error = None
+        if compression == "zstd":
+            target = self._write_zstd
+        else:
+            target = self._write_bgzf
+        self.thread = threading.Thread(target=target)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _chunks(self):
+        """Get the chunks of data queued by write."""
+        data = self.queue.get()
+        while data is not None:
+            yield data
+            data = self.queue.get()
+
+    def _write_bgzf(self):
+        """Cut data in BGZF blocks and write them."""
+        tail = b""
+        try:
+            for data in self._chunks():
+                data = tail + data
+                end = len(data) - len(data) % BGZF_BLOCK_SIZE
+                self.handle.write(b"".join(
+                    compress_bgzf(data[i:i + BGZF_BLOCK_SIZE])
+                    for i in range(0, end, BGZF_BLOCK_SIZE)))
+                tail = data[end:]
+            if tail:
+                self.handle.write(compress_bgzf(tail))
+            self.handle.write(BGZF_EOF)
+        except (IOError, OSError) as err:
+            self.error = err
+            for data in self._chunks():
+                pass
+
+    def _write_zstd(self):
+        """Compress data with zstd and write it."""
+        try:
+            writer = zstandard.ZstdCompressor().stream_writer(self.handle)
+            for data in self._chunks():
+                writer.write(data)
+            writer.flush(zstandard.FLUSH_FRAME)
+        except (IOError, OSError) as err:
+            self.error = err
+            for data in self._chunks():
+                pass
+
+    def write(self, data):
+        """Buffer data and send it to the compression thread."""
+        if self.error:
+            raise self.error
+        self.pending.append(data)
+        self.length += len(data)
+        if self.length >= READ_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Send the buffered data to the compression thread."""
+        if self.pending:
+            self.queue.put(b"".join(self.pending))
+            self.pending = []
+            self.length = 0
+
+    def close(self):
+        """Compress the remaining data and close the file."""
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.handle.close()
+        if self.error:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_input(input_file):
+    """Open a plain, gzip, bgzip or zstd file for binary reading.
+      Arguments:
+          input_file: Path to the file
     """
+    handle = io.open(input_file, "rb")
+    # The magic is peeked in the read buffer, so that pipes do not lose
+    # their first bytes
+    header = handle.peek(18)[:18]
+    if header.startswith(GZIP_MAGIC):
+        if is_bgzf(header):
+            return ThreadedReader(handle, read_bgzf(handle))
+        return ThreadedReader(handle, read_gzip(handle))
+    elif header.startswith(ZSTD_MAGIC):
+        if not zstandard:
+            handle.close()
+            raise IOError("zstandard module is required to read {0}"
+                          .format(input_file))
+        return ThreadedReader(handle, read_zstd(handle))
+    return handle
+
+
+def open_output(output_file):
+    """Open a file for binary writing, compressed according to its extension.
+      Arguments:
+          output_file: Path to the file, standard output if None
     """
     if not output_file:
-        output = sys.stdout
-    else:
-        output = open(output_file, "wt")
+        return getattr(sys.stdout, "buffer", sys.stdout)
+    ext = os.path.splitext(output_file)[1]
+    if ext in (".gz", ".bgz"):
+        return ThreadedWriter(open(output_file, "wb"), "bgzf")
+    elif ext == ".zst":
+        if not zstandard:
+            raise IOError("zstandard module is required to write {0}"
+                          .format(output_file))
+        return ThreadedWriter(open(output_file, "wb"), "zstd")
+    return open(output_file, "wb")
+
+
+def read_blocks(handle, size=BLOCK_SIZE):
+    """Read a file object by blocks.
+      Arguments:
+          handle: Binary file object
+          size: Number of bytes read at once
+    """
+    return iter(lambda: handle.read(size), b"")
+
+
+def check_records(headers, sequences, separators, qualities):
+    """Check the records of a block of reads.
+      Arguments:
+          headers: List of fastq headers
+          sequences: List of sequences
+          separators: List of separator lines
+          qualities: List of quality lines
+    """
+    for header, sequence, separator, quality in zip(headers, sequences,
+                                                    separators, qualities):
+        if not header.startswith(b"@"):
+            raise ValueError("Wrong fastq header: {0}".format(header))
+        if not separator.startswith(b"+"):
+            raise ValueError("Wrong fastq separator after {0}".format(
+                header))
+        if len(quality) != len(sequence):
+            raise ValueError("Quality and sequence lengths differ for {0}"
+                             .format(header))
+
+
+def read_fastq(blocks):
+    """Parse a fastq file by blocks of complete records.
+      Arguments:
+          blocks: Iterator over the successive parts of the file
+      Returns: An iterator over (headers, sequences, qualities) lists
+    """
+    tail = b""
+    for block in blocks:
+        if b"\r" in block:
+            block = block.replace(b"\r", b"")
+        lines = (tail + block).split(b"\n")
+        end = (len(lines) - 1) // 4 * 4
+        if end:
+            headers = lines[0:end:4]
+            sequences = lines[1:end:4]
+            qualities = lines[3:end:4]
+            check_records(headers, sequences, lines[2:end:4], qualities)
+            yield headers, sequences, qualities
+        tail = b"\n".join(lines[end:])
+    # Last record without final newline
+    lines = tail.split(b"\n")
+    if len(lines) == 4:
+        check_records(lines[0:1], lines[1:2], lines[2:3], lines[3:4])
+        yield lines[0:1], lines[1:2], lines[3:4]
+    elif tail:
+        raise ValueError("Truncated fastq record: {0}".format(lines[0]))
+
+
+def convert_block(headers, sequences, label):
+    """Build the fasta records of a block of reads.
+      Arguments:
+          headers: List of fastq headers
+          sequences: List of sequences
+          label: Text added after the read name (and its newline)
+    """
+    records = [b""] * (2 * len(headers) + 1)
+    records[0:-1:2] = [b">" + name + label for name in get_names(headers)]
+    records[1:-1:2] = sequences
+    return b"\n".join(records)
+
+
+def get_names(headers):
+    """Get the read names of a block of fastq headers.
+      Arguments:
+          headers: List of fastq headers
+    """
+    # The read name loses "@" and its first character like with the
+    # line based parser used before
+    return [header.split(b" ", 1)[0][2:] for header in headers]
+
+
+class Dereplicator(object):
+    """Count the identical sequences of a sample.
+    Each unique sequence keeps the name of its first read.
+    """
+    def __init__(self):
+        self.index = {}
+        self.names = []
+        self.sequences = []
+        self.counts = []
+
+    def add(self, headers, sequences):
+        """Add a block of reads.
+          Arguments:
+              headers: List of fastq headers
+              sequences: List of sequences
+        """
+        index = self.index
+        counts = self.counts
+        for name, sequence in zip(get_names(headers), sequences):
+            num = index.get(sequence)
+            if num is None:
+                index[sequence] = len(counts)
+                self.names.append(name)
+                self.sequences.append(sequence)
+                counts.append(1)
+            else:
+                counts[num] += 1
+
+    def update(self, other):
+        """Add the unique sequences of a following part of the sample.
+          Arguments:
+              other: Dereplicator of the part
+        """
+        for name, sequence, count in zip(other.names, other.sequences,
+                                         other.counts):
+            num = self.index.get(sequence)
+            if num is None:
+                self.index[sequence] = len(self.counts)
+                self.names.append(name)
+                self.sequences.append(sequence)
+                self.counts.append(count)
+            else:
+                self.counts[num] += count
+
+    def write(self, output, label):
+        """Write the unique sequences by decreasing abundance.
+          Arguments:
+              output: Binary file object
+              label: Text added after the size annotation
+        """
+        counts = self.counts
+        # Ties keep the order of the first occurrence
+        order = sorted(range(len(counts)), key=counts.__getitem__,
+                       reverse=True)
+        for start in range(0, len(order), 100000):
+            records = []
+            for num in order[start:start + 100000]:
+                records.append(b">" + self.names[num] + b";size=" +
+                               str(counts[num]).encode() + label + b"\n" +
+                               self.sequences[num] + b"\n")
+            output.write(b"".join(records))
+
+
+class QualityFilter(object):
+    """Discard reads on their expected errors, length and number of N.
+      Arguments:
+          max_ee: Maximum number of expected errors, not checked if None
+          min_length: Minimum read length
+          max_ns: Maximum number of N, not checked if None
+          offset: ASCII offset of the quality scores
+    """
+    def __init__(self, max_ee=None, min_length=0, max_ns=None, offset=33):
+        self.max_ee = max_ee
+        self.min_length = min_length
+        self.max_ns = max_ns
+        # Error probability of each quality character
+        self.table = [10.0 ** (-max(char - offset, 0) / 10.0)
+                      for char in range(256)]
+
+    def keep_numpy(self, sequences, qualities):
+        """Select the reads of a block with NumPy.
+          Returns: The list of the indexes of the kept reads
+        """
+        lengths = numpy.fromiter(map(len, sequences), numpy.int64,
+                                 len(sequences))
+        keep = lengths >= self.min_length
+        if self.max_ee is not None:
+            qual_lengths = numpy.fromiter(map(len, qualities), numpy.int64,
+                                          len(qualities))
+            probs = numpy.array(self.table)[numpy.frombuffer(
+                b"".join(qualities), numpy.uint8)]
+            # Sum of the probabilities of each read from the cumulative sum
+            total = numpy.concatenate(([0.0], numpy.cumsum(probs)))
+            ends = numpy.cumsum(qual_lengths)
+            keep &= total[ends] - total[ends - qual_lengths] <= self.max_ee
+        if self.max_ns is not None:
+            bases = numpy.frombuffer(b"".join(sequences), numpy.uint8)
+            total = numpy.concatenate(([0], numpy.cumsum(
+                (bases == ord("N")) | (bases == ord("n")))))
+            ends = numpy.cumsum(lengths)
+            keep &= total[ends] - total[ends - lengths] <= self.max_ns
+        return numpy.flatnonzero(keep).tolist()
+
+    def keep_python(self, sequences, qualities):
+        """Select the reads of a block without NumPy.
+          Returns: The list of the indexes of the kept reads
+        """
+        table = self.table.__getitem__
+        kept = []
+        for i, (sequence, quality) in enumerate(zip(sequences, qualities)):
+            if len(sequence) < self.min_length:
+                continue
+            if (self.max_ee is not None and
+                    sum(map(table, bytearray(quality))) > self.max_ee):
+                continue
+            if (self.max_ns is not None and sequence.count(b"N") +
+                    sequence.count(b"n") > self.max_ns):
+                continue
+            kept.append(i)
+        return kept
+
+    def __call__(self, headers, sequences, qualities):
+        """Filter a block of reads.
+          Returns: The headers and the sequences of the kept reads
+        """
+        if numpy:
+            kept = self.keep_numpy(sequences, qualities)
+        else:
+            kept = self.keep_python(sequences, qualities)
+        if len(kept) == len(headers):
+            return headers, sequences
+        return [headers[i] for i in kept], [sequences[i] for i in kept]
+
+
+def find_record(data, pos=0):
+    """Get the position of the first complete fastq record after pos.
+      Arguments:
+          data: Part of a fastq file
+          pos: Search start, the line containing pos is skipped if pos
+               is not at the beginning of a line
+      Returns: The position of the record, -1 if there is none
+    """
+    if pos > 0 and data[pos - 1:pos] != b"\n":
+        pos = data.find(b"\n", pos) + 1
+    while pos > 0 or (pos == 0 and data):
+        ends = []
+        end = pos
+        for _ in range(4):
+            end = data.find(b"\n", end)
+            if end < 0:
+                return -1
+            ends.append(end)
+            end += 1
+        # A quality line can start with "@", the separator line and the
+        # length of the sequence are checked too
+        if (data[pos:pos + 1] == b"@"
+                and data[ends[1] + 1:ends[1] + 2] == b"+"
+                and ends[1] - ends[0] == ends[3] - ends[2]):
+            return pos
+        pos = ends[0] + 1
+    return -1
+
+
+def find_plain_record(handle, target):
+    """Get the position of the first record starting after target.
+      Arguments:
+          handle: Binary file object of a plain fastq file
+          target: Position in the file
+      Returns: The position of the record, None if there is none
+    """
+    size = 1 << 16
+    # The byte before target tells if target starts a line, files smaller
+    # than the number of parts give a target of 0
+    start = max(target - 1, 0)
+    while True:
+        handle.seek(start)
+        data = handle.read(size)
+        pos = find_record(data, target - start)
+        if pos >= 0:
+            return start + pos
+        if len(data) < size:
+            return None
+        size *= 2
+
+
+def find_bgzf_record(handle, target):
+    """Get the virtual position of the first record starting in a BGZF
+    block after target.
+      Arguments:
+          handle: Binary file object of a BGZF file
+          target: Position in the compressed file
+      Returns: A (block position, position in the block) tuple, None if
+               there is no record
+    """
+    handle.seek(target)
+    data = handle.read(1 << 17)
+    pos = data.find(BGZF_MAGIC)
+    while pos >= 0:
+        # Check that the next block follows the candidate block
+        if is_bgzf(data[pos:pos + 18]):
+            next_pos = pos + struct.unpack_from("<H", data, pos + 16)[0] + 1
+            if (next_pos >= len(data)
+                    or data[next_pos:next_pos + 4] == BGZF_MAGIC):
+                break
+        pos = data.find(BGZF_MAGIC, pos + 1)
+    if pos < 0:
+        return None
+    handle.seek(target + pos)
+    blocks = []
+    data = b""
+    for offset, block in read_bgzf_blocks(handle, target + pos):
+        # The block can start in the middle of a line, the first line is
+        # skipped
+        blocks.append((offset, len(data)))
+        data += block
+        pos = find_record(data, 1)
+        if pos >= 0:
+            for offset, block_start in reversed(blocks):
+                if block_start <= pos:
+                    return offset, pos - block_start
+    return None
+
+
+def get_chunks(fastq_file, threads):
+    """Cut a fastq file in parts made of complete records.
+      Arguments:
+          fastq_file: Path to a plain or BGZF fastq file
+          threads: Minimum number of parts
+      Returns: A list of (start, end) positions, positions are BGZF virtual
+               positions for compressed files. None if the file cannot be
+               split.
+    """
+    size = os.path.getsize(fastq_file)
+    with open(fastq_file, "rb") as handle:
+        header = handle.read(18)
+        if header.startswith(GZIP_MAGIC) or header.startswith(ZSTD_MAGIC):
+            if not is_bgzf(header):
+                return None
+            find_position = find_bgzf_record
+            positions = [(0, 0)]
+            end = (size, 0)
+        else:
+            find_position = find_plain_record
+            positions = [0]
+            end = size
+        nb_chunks = max(threads, size // CHUNK_SIZE)
+        for i in range(1, nb_chunks):
+            pos = find_position(handle, size * i // nb_chunks)
+            if pos is None:
+                break
+            if pos > positions[-1]:
+                positions.append(pos)
+    positions.append(end)
+    return list(zip(positions[:-1], positions[1:]))
+
+
+def read_plain_range(handle, start, end, size=BLOCK_SIZE):
+    """Read a part of a plain file by blocks.
+      Arguments:
+          handle: Binary file object
+          start: Position of the first byte
+          end: Position after the last byte
+          size: Number of bytes read at once
+    """
+    handle.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        data = handle.read(min(size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def read_bgzf_range(handle, start, end, size=BLOCK_SIZE):
+    """Read a part of a BGZF file by blocks.
+      Arguments:
+          handle: Binary file object
+          start: Virtual position of the first byte
+          end: Virtual position after the last byte
+          size: Minimum number of bytes returned at once
+    """
+    handle.seek(start[0])
+    pending = []
+    length = 0
+    for offset, block in read_bgzf_blocks(handle, start[0]):
+        if offset > end[0] or (offset == end[0] and not end[1]):
+            break
+        if offset == end[0]:
+            block = block[:end[1]]
+        if offset == start[0]:
+            block = block[start[1]:]
+        pending.append(block)
+        length += len(block)
+        if length >= size:
+            yield b"".join(pending)
+            pending = []
+            length = 0
+    if pending:
+        yield b"".join(pending)
+
+
+def convert_range(task):
+    """Convert a part of a fastq file, run by the process pool.
+      Arguments:
+          task: (fastq file, start, end, label, count lengths, quality
+                filter, dereplicate) tuple
+      Returns: The fasta records, the read length histogram (None if
+               lengths are not counted) and the Dereplicator of the part
+               (None if the reads are not dereplicated)
+    """
+    (fastq_file, start, end, label, count_lengths, quality_filter,
+     dereplicate) = task
+    records = []
+    lengths = collections.Counter() if count_lengths else None
+    uniques = Dereplicator() if dereplicate else None
+    with open(fastq_file, "rb") as handle:
+        if isinstance(start, tuple):
+            blocks = read_bgzf_range(handle, start, end)
+        else:
+            blocks = read_plain_range(handle, start, end)
+        for headers, sequences, qualities in read_fastq(blocks):
+            if count_lengths:
+                lengths.update(map(len, sequences))
+            if quality_filter:
+                headers, sequences = quality_filter(headers, sequences,
+                                                    qualities)
+            if dereplicate:
+                uniques.add(headers, sequences)
+            else:
+                records.append(convert_block(headers, sequences, label))
+    if dereplicate:
+        # The index is rebuilt when the parts are merged
+        uniques.index = None
+    return b"".join(records), lengths, uniques
+
+
+def convert_parallel(fastq_file, chunks, label, threads,
+                     count_lengths=False, quality_filter=None,
+                     dereplicate=False):
+    """Convert the parts of a fastq file with a process pool.
+      Arguments:
+          fastq_file: Path to the fastq file
+          chunks: List of (start, end) positions
+          label: Text added after the read names
+          threads: Number of processes
+          count_lengths: Count the read lengths of each part
+          quality_filter: QualityFilter applied to the reads, None to keep
+                          all of them
+          dereplicate: Dereplicate the reads of each part
+      Returns: An iterator over the results of convert_range for each part,
+               in the file order
+    """
+    pool = multiprocessing.Pool(threads)
     try:
-        with open(fastq_file, "rt") as fastq:
-            for line in fastq:
-                header = line[1:].split(" ")[0]
-                line = fastq.next()
-                if sample_name:
-                    print(">{0};barcodelabel={2}\n{1}".format(
-                            header[1:].replace("\n", ""), line.replace("\n", ""), sample_name),
-                            file=output)
+        pending = collections.deque()
+        for start, end in chunks:
+            pending.append(pool.apply_async(
+                convert_range,
+                ((fastq_file, start, end, label, count_lengths,
+                  quality_filter, dereplicate),)))
+            # Limit the number of converted parts waiting in memory
+            if len(pending) > 2 * threads:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+
+
+def write_fasta(fastq_file, label, output, threads=1, lengths=None,
+                quality_filter=None, dereplicate=False):
+    """Convert a fastq file in fasta, one block of reads at a time.
+      Arguments:
+          fastq_file: Path to the fastq file
+          label: Text added after the read names
+          output: Binary file object receiving the fasta records
+          threads: Number of processes (plain and BGZF files only)
+          lengths: Counter updated with the read lengths of the fastq file,
+                   not counted if None
+          quality_filter: QualityFilter applied to the reads, None to keep
+                          all of them
+          dereplicate: Write the unique sequences with their abundance
+                       instead of the reads
+    """
+    uniques = Dereplicator() if dereplicate else None
+    chunks = None
+    if threads > 1:
+        chunks = get_chunks(fastq_file, threads)
+    if chunks:
+        for block, block_lengths, block_uniques in convert_parallel(
+                fastq_file, chunks, label, threads, lengths is not None,
+                quality_filter, dereplicate):
+            output.write(block)
+            if block_lengths:
+                lengths.update(block_lengths)
+            if block_uniques:
+                uniques.update(block_uniques)
+    else:
+        fastq = open_input(fastq_file)
+        try:
+            for headers, sequences, qualities in read_fastq(
+                    read_blocks(fastq)):
+                if lengths is not None:
+                    lengths.update(map(len, sequences))
+                if quality_filter:
+                    headers, sequences = quality_filter(headers, sequences,
+                                                        qualities)
+                if dereplicate:
+                    uniques.add(headers, sequences)
                 else:
-                    print(">{0}\n{1}".format(header[1:], line.replace("\n", "")),
-                          file=output)
-                fastq.next()
-                fastq.next()
+                    output.write(convert_block(headers, sequences, label))
+        finally:
+            fastq.close()
+    if dereplicate:
+        uniques.write(output, label)
+
+
+def get_length_stats(lengths):
+    """Summarize a read length histogram.
+      Arguments:
+          lengths: Dict of the number of reads of each length
+      Returns: The number of reads, the mean, median and N50 lengths
+    """
+    count = sum(lengths.values())
+    if not count:
+        return 0, 0.0, 0, 0
+    total = sum(length * number for length, number in lengths.items())
+    # Median as the middle element of the sorted lengths
+    median = None
+    seen = 0
+    for length in sorted(lengths):
+        seen += lengths[length]
+        if seen > count // 2:
+            median = length
+            break
+    seen = 0
+    for n50 in sorted(lengths, reverse=True):
+        seen += n50 * lengths[n50]
+        if 2 * seen >= total:
+            break
+    return count, float(total) / count, median, n50
+
+
+def write_stats(stats_file, lengths):
+    """Write the read length statistics of a fastq file.
+      Arguments:
+          stats_file: Path to the statistics file
+          lengths: Dict of the number of reads of each length
+    """
+    count, mean, median, n50 = get_length_stats(lengths)
+    with open(stats_file, "wt") as stats:
+        stats.write("# count\t{0}\n# mean\t{1:.2f}\n# median\t{2}\n"
+                    "# n50\t{3}\n".format(count, mean, median, n50))
+        stats.write("length\treads\n")
+        for length in sorted(lengths):
+            stats.write("{0}\t{1}\n".format(length, lengths[length]))
+
+
+def get_stats_file(fastq_file):
+    """Get the path of the statistics file written next to a fastq file.
+      Arguments:
+          fastq_file: Path to the fastq file
+    """
+    return fastq_file + ".stats"
+
+
+def get_label(sample_name):
+    """Get the text added after the read names.
+      Arguments:
+          sample_name: Sample added to the headers (barcodelabel)
+    """
+    if sample_name:
+        return b";barcodelabel=" + sample_name.encode()
+    return b""
+
+
+def convert_fastq_fasta(fastq_file, sample_name, output_file, threads=1,
+                        stats=False, quality_filter=None, dereplicate=False):
+    """Convert a fastq file in fasta.
+      Arguments:
+          fastq_file: Path to the fastq file
+          sample_name: Sample added to the headers (barcodelabel)
+          output_file: Path to the output file, standard output if None
+          threads: Number of processes (plain and BGZF files only)
+          stats: Write the read length statistics next to the fastq file
+          quality_filter: QualityFilter applied to the reads, None to keep
+                          all of them
+          dereplicate: Write the unique sequences with their abundance
+                       instead of the reads
+    """
+    lengths = collections.Counter() if stats else None
+    try:
+        output = open_output(output_file)
+    except IOError:
+        sys.exit("Error cannot open {0}".format(output_file))
+    try:
+        write_fasta(fastq_file, get_label(sample_name), output, threads,
+                    lengths, quality_filter, dereplicate)
     except IOError:
         sys.exit("Error cannot open {0}".format(fastq_file))
+    except ValueError as err:
+        sys.exit("Error in {0}: {1}".format(fastq_file, err))
     if output_file:
         output.close()
+    if stats:
+        stats_file = get_stats_file(fastq_file)
+        try:
+            write_stats(stats_file, lengths)
+        except IOError:
+            sys.exit("Error cannot open {0}".format(stats_file))
+
+
+def get_sample_name(fastq_file):
+    """Get the sample name from a fastq file name like masque.sh does.
+      Arguments:
+          fastq_file: Path to the fastq file
+    """
+    filename = os.path.basename(fastq_file)
+    root, ext = os.path.splitext(filename)
+    if ext in (".gz", ".bgz", ".zst"):
+        filename = root
+    return os.path.splitext(filename)[0]
+
+
+def load_manifest(manifest_file):
+    """Load the samples of a batch conversion.
+      Arguments:
+          manifest_file: Tabulated file with the fastq file, the sample name
+                         and the output file of each sample
+      Returns: A list of (fastq file, sample name, output file) tuples
+    """
+    samples = []
+    try:
+        with open(manifest_file, "rt") as manifest:
+            for num, line in enumerate(manifest, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                fields = line.split("\t")
+                if len(fields) != 3:
+                    sys.exit("Error in {0} line {1}: expected 3 columns "
+                             "(fastq, sample, output)"
+                             .format(manifest_file, num))
+                samples.append(tuple(fields))
+    except IOError:
+        sys.exit("Error cannot open {0}".format(manifest_file))
+    return samples
+
+
+def glob_samples(pattern, output_dir):
+    """Get the samples of a batch conversion from a glob pattern.
+      Arguments:
+          pattern: Glob pattern of the fastq files
+          output_dir: Directory of the fasta files, named <sample>.fasta
+      Returns: A list of (fastq file, sample name, output file) tuples
+    """
+    samples = []
+    for fastq_file in sorted(glob.glob(pattern)):
+        sample_name = get_sample_name(fastq_file)
+        samples.append((fastq_file, sample_name,
+                        os.path.join(output_dir, sample_name + ".fasta")))
+    return samples
+
+
+def convert_sample(task):
+    """Convert the fastq file of one sample, run by the process pool.
+      Arguments:
+          task: (fastq file, sample name, output file, threads, stats,
+                quality filter, dereplicate) tuple
+      Returns: An error message, None if the conversion succeeded
+    """
+    (fastq_file, sample_name, output_file, threads, stats, quality_filter,
+     dereplicate) = task
+    lengths = collections.Counter() if stats else None
+    try:
+        output = open_output(output_file)
+    except IOError:
+        return "Error cannot open {0}".format(output_file)
+    try:
+        try:
+            write_fasta(fastq_file, get_label(sample_name), output, threads,
+                        lengths, quality_filter, dereplicate)
+        finally:
+            output.close()
+    except IOError:
+        return "Error cannot open {0}".format(fastq_file)
+    except ValueError as err:
+        return "Error in {0}: {1}".format(fastq_file, err)
+    if stats:
+        stats_file = get_stats_file(fastq_file)
+        try:
+            write_stats(stats_file, lengths)
+        except IOError:
+            return "Error cannot open {0}".format(stats_file)
+    return None
+
+
+def append_file(input_file, output):
+    """Copy a plain or compressed file at the end of another one.
+      Arguments:
+          input_file: Path to the file to copy
+          output: Binary file object
+    """
+    handle = open_input(input_file)
+    try:
+        for block in read_blocks(handle):
+            output.write(block)
+    finally:
+        handle.close()
+
+
+def convert_batch(samples, amplicon_file, threads=1, stats=False,
+                  quality_filter=None, dereplicate=False):
+    """Convert the fastq files of several samples in a single process pool.
+      Arguments:
+          samples: List of (fastq file, sample name, output file) tuples
+          amplicon_file: Path to the concatenation of all the fasta files,
+                         not written if None
+          threads: Number of processes
+          stats: Write the read length statistics next to each fastq file
+          quality_filter: QualityFilter applied to the reads, None to keep
+                          all of them
+          dereplicate: Write the unique sequences of each sample with their
+                       abundance instead of the reads
+    """
+    if not samples:
+        sys.exit("Error no fastq file to convert")
+    if len(samples) == 1:
+        # A single file is cut in parts instead
+        tasks = [samples[0] + (threads, stats, quality_filter, dereplicate)]
+        results = map(convert_sample, tasks)
+        pool = None
+    else:
+        tasks = [sample + (1, stats, quality_filter, dereplicate)
+                 for sample in samples]
+        pool = multiprocessing.Pool(min(threads, len(samples)))
+        results = pool.imap(convert_sample, tasks)
+    amplicon = None
+    try:
+        if amplicon_file:
+            try:
+                amplicon = open_output(amplicon_file)
+            except IOError:
+                sys.exit("Error cannot open {0}".format(amplicon_file))
+        # Samples are appended to the amplicon file in the manifest order
+        # as soon as they are converted
+        for (_, _, output_file), error in zip(samples, results):
+            if error:
+                sys.exit(error)
+            if amplicon:
+                try:
+                    append_file(output_file, amplicon)
+                except IOError:
+                    sys.exit("Error cannot write {0}".format(amplicon_file))
+        if pool:
+            pool.close()
+            pool.join()
+    finally:
+        if pool:
+            pool.terminate()
+    if amplicon:
+        amplicon.close()
 
 
 def main():
     """Main program
     """
     args = getArguments()
-    convert_fastq_fasta(args.fastq_file, args.sample_name, args.output_file)
+    quality_filter = None
+    if (args.max_ee is not None or args.min_length
+            or args.max_ns is not None):
+        quality_filter = QualityFilter(args.max_ee, args.min_length,
+                                       args.max_ns, args.offset)
+    if args.manifest_file or args.pattern:
+        if args.manifest_file:
+            samples = load_manifest(args.manifest_file)
+        else:
+            samples = glob_samples(args.pattern, args.output_file or ".")
+        convert_batch(samples, args.amplicon_file, args.threads, args.stats,
+                      quality_filter, args.dereplicate)
+    else:
+        convert_fastq_fasta(args.fastq_file, args.sample_name,
+                            args.output_file, args.threads, args.stats,
+                            quality_filter, args.dereplicate)
 
 
 if __name__ == '__main__':
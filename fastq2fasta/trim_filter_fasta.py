@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    A copy of the GNU General Public License is available at
+#    http://www.gnu.org/licenses/gpl-3.0.html
+
+"""Trim single-end reads with AlienTrimmer, filter them against contaminant
+databases with bowtie2 and convert them in fasta in one streaming pass."""
+from __future__ import print_function
+import os
+import sys
+import argparse
+import collections
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import fastq2fasta
+
+
+def isfile(path):
+    """Check if path is an existing file.
+      Arguments:
+          path: Path to the file
+    """
+    if not os.path.isfile(path):
+        if os.path.isdir(path):
+            msg = "{0} is a directory".format(path)
+        else:
+            msg = "{0} does not exist.".format(path)
+        raise argparse.ArgumentTypeError(msg)
+    return path
+
+
+def isdir(path):
+    """Check if path is an existing directory.
+      Arguments:
+          path: Path to the directory
+    """
+    if not os.path.isdir(path):
+        if os.path.isfile(path):
+            msg = "{0} is a file".format(path)
+        else:
+            msg = "{0} does not exist.".format(path)
+        raise argparse.ArgumentTypeError(msg)
+    return path
+
+
+def contaminant(value):
+    """Check a contaminant database given as name=bowtie2 index.
+      Arguments:
+          value: Argument of -x
+    """
+    name, sep, index = value.partition("=")
+    if not sep or not name or not index:
+        raise argparse.ArgumentTypeError(
+            "{0} is not in the name=index format".format(value))
+    return name, index
+
+
+def getArguments():
+    """Retrieves the arguments of the program.
+      Returns: An object that contains the arguments
+    """
+    # Parsing arguments
+    parser = argparse.ArgumentParser(description=__doc__, usage=
+                                     "{0} -h".format(sys.argv[0]))
+    parser.add_argument('-i', dest='fastq_file', type=isfile, required=True,
+                        help='Path to the fastq file (plain, gzip, bgzip or '
+                        'zstd compressed).')
+    parser.add_argument('-s', dest='sample_name', type=str, required=True,
+                        help='Sample name added to the reads and to the log '
+                        'files.')
+    parser.add_argument('-o', dest='output_file', type=str, required=True,
+                        help='Output fasta file.')
+    parser.add_argument('-f', dest='filtered_fastq', type=str, default=None,
+                        help='Write also the filtered reads in this fastq '
+                        'file (for quality control).')
+    parser.add_argument('-c', dest='alien_file', type=isfile, required=True,
+                        help='Alien sequences given to AlienTrimmer.')
+    parser.add_argument('-x', dest='contaminants', type=contaminant,
+                        action='append', default=[],
+                        help='Contaminant database as name=bowtie2 index, '
+                        'can be repeated. Databases are used in order, by '
+                        'bowtie2 processes running at the same time: all '
+                        'the indexes are loaded in memory together.')
+    parser.add_argument('-l', dest='minreadlength', type=int, default=35,
+                        help='Minimum read length (default = 35).')
+    parser.add_argument('-p', dest='minphredperc', type=int, default=80,
+                        help='Minimum percentage of correct nucleotides '
+                        '(default = 80).')
+    parser.add_argument('-q', dest='minphred', type=int, default=20,
+                        help='Minimum Phred quality score (default = 20).')
+    parser.add_argument('-N', dest='mismatch', type=int, default=1,
+                        help='Number of mismatches allowed in the seed '
+                        'alignment of bowtie2 (default = 1).')
+    parser.add_argument('-t', dest='threads', type=int, default=1,
+                        help='Number of threads shared by the bowtie2 '
+                        'processes (default = 1).')
+    parser.add_argument('-d', dest='log_dir', type=isdir, default=".",
+                        help='Directory of the log files (default = .).')
+    parser.add_argument('-e', dest='error_log_dir', type=isdir, default=".",
+                        help='Directory of the error log files '
+                        '(default = .).')
+    parser.add_argument('--alientrimmer', dest='alientrimmer', type=str,
+                        default="AlienTrimmer",
+                        help='AlienTrimmer command (default = AlienTrimmer).')
+    parser.add_argument('--bowtie2', dest='bowtie2', type=str,
+                        default="bowtie2",
+                        help='bowtie2 command (default = bowtie2).')
+    parser.add_argument('--stats', dest='stats', action='store_true',
+                        default=False, help='Write the read length statistics '
+                        'of the filtered reads next to the -f file.')
+    args = parser.parse_args()
+    if args.stats and not args.filtered_fastq:
+        parser.error("--stats requires -f")
+    return args
+
+
+def decompress_input(fastq_file, tmp_dir):
+    """Decompress a compressed fastq file, AlienTrimmer reads its input
+    twice and cannot read a compressed file or a pipe.
+      Arguments:
+          fastq_file: Path to the fastq file
+          tmp_dir: Directory of the decompressed file
+      Returns: The path of the decompressed file, fastq_file if it is not
+               compressed
+    """
+    fastq = fastq2fasta.open_input(fastq_file)
+    if isinstance(fastq, fastq2fasta.ThreadedReader):
+        plain_file = os.path.join(tmp_dir, "input.fastq")
+        with open(plain_file, "wb") as plain:
+            for block in fastq2fasta.read_blocks(fastq):
+                plain.write(block)
+        fastq.close()
+        return plain_file
+    fastq.close()
+    return fastq_file
+
+
+def hold_fifo(fifo):
+    """Create a fifo and keep it open on both sides. Its writer never waits
+    for its reader, never gets a broken pipe, and the reader only gets the
+    end of file once this handle is closed, after the writer exited.
+      Arguments:
+          fifo: Path to the fifo
+      Returns: The handle of the fifo
+    """
+    os.mkfifo(fifo)
+    return os.open(fifo, os.O_RDWR)
+
+
+def run_step(cmd, steps, log, error):
+    """Start a step of the pipeline, the steps already started are stopped
+    when it cannot be run.
+      Arguments:
+          cmd: Command line of the step
+          steps: List of the (step name, process, error log) tuples of the
+                 steps already started
+          log: File receiving the standard output
+          error: File receiving the standard error
+      Returns: The process of the step
+    """
+    try:
+        return subprocess.Popen(cmd, stdout=log, stderr=error,
+                                close_fds=True)
+    except OSError as err:
+        stop_pipeline(steps)
+        for _, process, _ in steps:
+            process.wait()
+        sys.exit("Error cannot run {0}: {1}".format(cmd[0], err))
+
+
+def start_pipeline(args, fastq_file, tmp_dir):
+    """Start AlienTrimmer and the bowtie2 filters, connected by fifos.
+      Arguments:
+          args: Arguments of the program
+          fastq_file: Path to the plain fastq file
+          tmp_dir: Directory of the fifos
+      Returns: A list of (step name, process, error log) tuples, the list
+               of the fifos written by each step, the last one receives the
+               filtered reads, and the list of their handles
+    """
+    steps = []
+    fifos = []
+    handles = []
+    # The bowtie2 steps run at the same time, they share the threads
+    threads = max(args.threads // max(len(args.contaminants), 1), 1)
+    fifo = os.path.join(tmp_dir, "alien.fastq")
+    handles.append(hold_fifo(fifo))
+    log = open(os.path.join(args.log_dir, "log_alientrimmer_{0}.txt"
+                            .format(args.sample_name)), "wb")
+    error_log = os.path.join(args.error_log_dir,
+                             "error_log_alientrimmer_{0}.txt"
+                             .format(args.sample_name))
+    cmd = shlex.split(args.alientrimmer) + [
+        "-i", fastq_file, "-o", fifo, "-c", args.alien_file,
+        "-l", str(args.minreadlength), "-p", str(args.minphredperc),
+        "-q", str(args.minphred)]
+    with open(error_log, "wb") as error:
+        steps.append(("AlienTrimmer", run_step(cmd, steps, log, error),
+                      error_log))
+    fifos.append(fifo)
+    log.close()
+    for num, (name, index) in enumerate(args.contaminants):
+        unmapped = os.path.join(tmp_dir, "{0}_{1}.fastq".format(name, num))
+        handles.append(hold_fifo(unmapped))
+        log_file = os.path.join(args.log_dir, "log_mapping_{0}_{1}_{2}.txt"
+                                .format(args.sample_name, name, num))
+        cmd = shlex.split(args.bowtie2) + [
+            "-q", "-N", str(args.mismatch), "-p", str(threads),
+            "-x", index, "-U", fifo, "-S", os.devnull, "--un", unmapped,
+            "-t", "--end-to-end", "--very-fast"]
+        with open(log_file, "wb") as log:
+            steps.append(("bowtie2 against {0}".format(name),
+                          run_step(cmd, steps, log, subprocess.STDOUT),
+                          log_file))
+        fifo = unmapped
+        fifos.append(fifo)
+    return steps, fifos, handles
+
+
+def tee_blocks(blocks, copy):
+    """Copy the blocks of a file while they are parsed.
+      Arguments:
+          blocks: Iterator over the successive parts of the file
+          copy: Binary file object, nothing is copied if None
+    """
+    for block in blocks:
+        if copy:
+            copy.write(block)
+        yield block
+
+
+def convert_stream(fastq, label, output_file, filtered_fastq, lengths=None):
+    """Convert the filtered reads in fasta while they are produced.
+      Arguments:
+          fastq: Binary file object of the fifo receiving the filtered
+                 reads
+          label: Text added after the read names
+          output_file: Path to the fasta file
+          filtered_fastq: Path to the copy of the filtered reads, None to
+                          skip it
+          lengths: Counter updated with the read lengths, not counted if
+                   None
+    """
+    copy = None
+    output = fastq2fasta.open_output(output_file)
+    try:
+        if filtered_fastq:
+            copy = fastq2fasta.open_output(filtered_fastq)
+        blocks = tee_blocks(fastq2fasta.read_blocks(fastq), copy)
+        for headers, sequences, _ in fastq2fasta.read_fastq(blocks):
+            output.write(fastq2fasta.convert_block(headers, sequences,
+                                                   label))
+            if lengths is not None:
+                lengths.update(map(len, sequences))
+    finally:
+        output.close()
+        if copy:
+            copy.close()
+
+
+def release_fifo(fifo, handle):
+    """Close the handle of a fifo whose writer exited and wait for its
+    reader to open it, the reader then gets the end of file. The fifo
+    stays open meanwhile, its data would be lost otherwise.
+      Arguments:
+          fifo: Path to the fifo
+          handle: Handle returned by hold_fifo
+    """
+    writer = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+    os.close(handle)
+    os.close(os.open(fifo, os.O_WRONLY))
+    os.close(writer)
+
+
+def wait_step(num, steps, fifos, handles, readers, exited, failed, lock):
+    """Wait for a step of the pipeline, run by one thread per step. The
+    first step that fails, or that exits before the end of its input,
+    stops the whole pipeline. The fifo written by the step is then
+    released.
+      Arguments:
+          num: Index of the step
+          steps: List of (step name, process, error log) tuples
+          fifos: List of the fifos written by each step
+          handles: List of the handles of these fifos
+          readers: List receiving the read side of the fifos whose reader
+                   exited, the previous step may still wait for a reader
+                   and the reads left there are checked
+          exited: Set receiving the index of the steps that exited
+          failed: List receiving the step to blame
+          lock: Lock protecting exited and failed
+    """
+    code = steps[num][1].wait()
+    unread = False
+    if num:
+        reader = os.open(fifos[num - 1], os.O_RDONLY | os.O_NONBLOCK)
+        readers.append(reader)
+        try:
+            unread = len(os.read(reader, 1)) > 0
+        except OSError:
+            # Empty but still written
+            pass
+    with lock:
+        # The end of its input comes only after the previous step exited
+        early = unread or (num > 0 and num - 1 not in exited)
+        exited.add(num)
+        if (code or early) and not failed:
+            failed.append(steps[num])
+            stop_pipeline(steps)
+    release_fifo(fifos[num], handles[num])
+
+
+def stop_pipeline(steps):
+    """Kill the processes of the pipeline still running, they are waited
+    for by their own thread."""
+    for _, process, _ in steps:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+
+def trim_filter_fasta(args):
+    """Trim, filter and convert the reads of a sample.
+      Arguments:
+          args: Arguments of the program
+    """
+    failed = []
+    lengths = collections.Counter() if args.stats else None
+    tmp_dir = tempfile.mkdtemp(
+        prefix="{0}_".format(args.sample_name),
+        dir=os.path.dirname(os.path.abspath(args.output_file)))
+    steps = []
+    waiters = []
+    readers = []
+    fastq = None
+    exited = set()
+    lock = threading.Lock()
+    try:
+        try:
+            fastq_file = decompress_input(args.fastq_file, tmp_dir)
+            steps, fifos, handles = start_pipeline(args, fastq_file,
+                                                   tmp_dir)
+            # Opened before the last step can exit, closed at the end
+            fastq = open(fifos[-1], "rb")
+            for num in range(len(steps)):
+                waiters.append(threading.Thread(
+                    target=wait_step, args=(num, steps, fifos, handles,
+                                            readers, exited, failed, lock)))
+                waiters[-1].start()
+            convert_stream(fastq, fastq2fasta.get_label(args.sample_name),
+                           args.output_file, args.filtered_fastq, lengths)
+            for waiter in waiters:
+                waiter.join()
+        except (IOError, OSError) as err:
+            sys.exit("Error: {0}".format(err))
+        except ValueError as err:
+            # A failing step is known before its reader gets the end of file
+            if not failed:
+                sys.exit("Error in the filtered reads: {0}".format(err))
+        # Reads lost by a failing step would give a truncated output
+        for name, process, log_file in failed:
+            if process.returncode == 0:
+                sys.exit("Error {0} stopped before the end of its input, "
+                         "see {1}".format(name, log_file))
+            sys.exit("Error {0} failed (exit code {1}), see {2}".format(
+                name, process.returncode, log_file))
+        if args.stats:
+            stats_file = fastq2fasta.get_stats_file(args.filtered_fastq)
+            try:
+                fastq2fasta.write_stats(stats_file, lengths)
+            except IOError:
+                sys.exit("Error cannot open {0}".format(stats_file))
+    except SystemExit:
+        for path in (args.output_file, args.filtered_fastq):
+            if path and os.path.isfile(path):
+                os.remove(path)
+        raise
+    finally:
+        stop_pipeline(steps)
+        for waiter in waiters:
+            waiter.join()
+        for reader in readers:
+            os.close(reader)
+        if fastq:
+            fastq.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    """Main program
+    """
+    args = getArguments()
+    trim_filter_fasta(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,15 @@ from __future__ import print_function
 import os
 import sys
 import argparse
+import array
+import collections
 import csv
+import heapq
+import itertools
+import mmap
+import multiprocessing
+import re
+import sqlite3
 
 __author__ = "Amine Ghozlane"
 __copyright__ = "Copyright 2015, Institut Pasteur"
@@ -24,6 +32,11 @@ __maintainer__ = "Amine Ghozlane"
 __email__ = "amine.ghozlane@pasteur.fr"
 __status__ = "Developpement"
 
+# Extension of the taxonomy index written next to a database
+INDEX_SUFFIX = ".taxidx"
+# Header line of a fasta record, after the first one
+HEADER = re.compile(br"\n>([^\n]*)")
+
 
 def isfile(path):
     """Check if path is an existing file.
@@ -53,6 +66,26 @@ def isdir(path):
     return path
 
 
+def annotation_job(value):
+    """Check an annotation job given as
+    hits:database:dtype:output[:biom output].
+      Arguments:
+          value: Argument of -j
+    """
+    fields = value.split(":")
+    if len(fields) not in (4, 5):
+        raise argparse.ArgumentTypeError(
+            "{0} is not in the hits:database:dtype:output[:biom output] "
+            "format".format(value))
+    if fields[2] not in PARSERS:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a database format ({1})".format(
+                fields[2], ", ".join(sorted(PARSERS))))
+    if len(fields) == 4:
+        fields.append(None)
+    return (isfile(fields[0]), isfile(fields[1])) + tuple(fields[2:])
+
+
 def getArguments():
     """Retrieves the arguments of the program.
       Returns: An object that contains the arguments
@@ -60,9 +93,9 @@ def getArguments():
     # Parsing arguments
     parser = argparse.ArgumentParser(description=__doc__, usage=
                                      "{0} -h".format(sys.argv[0]))
-    parser.add_argument('-i', dest='input_file', type=isfile, required=True,
+    parser.add_argument('-i', dest='input_file', type=isfile,
                         help='Path to the input file.')
-    parser.add_argument('-d', dest='database_file', type=isfile, required=True,
+    parser.add_argument('-d', dest='database_file', type=isfile,
                         help='Path to the database file.')
     parser.add_argument('-dtype', dest='database_type', type=str,
                         default="silva_ssu", choices=["itsdb_findley", "greengenes",
@@ -70,6 +103,13 @@ def getArguments():
                                                   "silva_ssu", "itsdb_underhill",
                                                   "itsdb_unite"],
                         help='Database format (default = silva_ssu).')
+    parser.add_argument('-x', dest='index_file', type=str, default=None,
+                        help='Path to the taxonomy index of the database '
+                        '(default = database file + {0}).'.format(INDEX_SUFFIX))
+    parser.add_argument('--build_index', dest='build_index',
+                        action='store_true', default=False,
+                        help='Build the taxonomy index of the database and '
+                        'exit.')
     #parser.add_argument('-t', dest='taxonomy_file', type=isfile,
     #                    help='Path to the taxonomy file (Greengenes and '
     #                    'Underhill only).')
@@ -82,54 +122,178 @@ def getArguments():
     parser.add_argument('-ob', dest='output_file_biom',
                         type=str, default=None,
                         help='Output file for biom input.')
+    parser.add_argument('-j', dest='jobs', type=annotation_job,
+                        action='append', default=[],
+                        help='Annotation job given as hits:database:dtype:'
+                        'output[:biom output], can be repeated instead of -i, '
+                        '-d, -dtype, -o and -ob. Each database is read once '
+                        'and each hit file is loaded once.')
+    parser.add_argument('-t', dest='threads', type=int, default=1,
+                        help='Number of databases read at the same time with '
+                        '-j (default = 1).')
+    parser.add_argument('-s', dest='strategy', type=str, default="first",
+                        choices=["first", "identity", "evalue", "lca"],
+                        help='Hit selected for each OTU: first hit, best '
+                        'identity, best e-value (blast tabular output with 12 '
+                        'columns or "6 qseqid sseqid pident qcovs evalue", '
+                        'vsearch writes no e-value) or lowest common '
+                        'ancestor of the best hits (default = first).')
+    parser.add_argument('-k', dest='top_hits', type=int, default=10,
+                        help='Number of hits with the best identity kept for '
+                        'each OTU with -s lca (default = 10).')
     args = parser.parse_args()
+    if args.top_hits < 1:
+        parser.error("argument -k must be at least 1")
+    if not args.jobs:
+        if not args.database_file:
+            parser.error("argument -d is required")
+        if not args.input_file and not args.build_index:
+            parser.error("argument -i is required")
     return args
 
 
-def load_vsearch(input_file):
-    """Load assignation provided with vsearch
+class HitTable(object):
+    """Hits selected for each query, stored in parallel arrays: the hits of
+    the query number n are hits[offsets[n]:offsets[n + 1]], best first, and
+    each hit is the number of its accession in accessions.
+    """
+    def __init__(self):
+        self.queries = []
+        self.identities = array.array("d")
+        self.offsets = array.array("L", [0])
+        self.hits = array.array("L")
+        self.accessions = []
+        self.accession_ids = {}
+
+    def add(self, query, hits):
+        """Add the selected hits of a query
+          Arguments:
+              query: Name of the query
+              hits: List of (identity, accession) tuples, best first
+        """
+        self.queries.append(query)
+        self.identities.append(hits[0][0])
+        for _, accession in hits:
+            accession_id = self.accession_ids.get(accession)
+            if accession_id is None:
+                accession_id = self.accession_ids[accession] = len(
+                    self.accessions)
+                self.accessions.append(accession)
+            self.hits.append(accession_id)
+        self.offsets.append(len(self.hits))
+
+    def __iter__(self):
+        """Iterate over the accessions of the hits
+        """
+        return iter(self.accessions)
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def get_queries(self):
+        """Get the name, identity and accessions of the queries, grouped by
+        accession of their best hit
+        """
+        order = sorted(range(len(self.queries)),
+                       key=lambda num: self.hits[self.offsets[num]])
+        for num in order:
+            yield (self.queries[num], self.identities[num],
+                   [self.accessions[hit] for hit in
+                    self.hits[self.offsets[num]:self.offsets[num + 1]]])
+
+
+def get_evalue(line):
+    """Get the e-value of a hit, from the blast6out format (12 columns) of
+    vsearch or from the "6 qseqid sseqid pident qcovs evalue" format of blast
+    """
+    if len(line) == 12:
+        return float(line[10])
+    elif len(line) == 5:
+        return float(line[4])
+    raise ValueError("no e-value column in {0} columns".format(len(line)))
+
+
+def select_hits(lines, strategy, top_hits):
+    """Select the hits of a query.
+      Arguments:
+          lines: Iterator over the rows of the query
+          strategy: first (first row), identity (best identity), evalue
+                    (best e-value) or lca (top_hits best identities)
+          top_hits: Number of hits kept for lca
+      Returns: List of (identity, accession) tuples, best first
     """
-    vsearch_dict = {}
-    OTU_prev = ""
+    if strategy == "first":
+        line = next(lines)
+        return [(float(line[2]), line[1].strip())]
+    elif strategy == "lca":
+        # Fixed size heap of the best hits, the first row wins the ties
+        best = []
+        for row, line in enumerate(lines):
+            hit = (float(line[2]), -row, line[1].strip())
+            if len(best) < top_hits:
+                heapq.heappush(best, hit)
+            else:
+                heapq.heappushpop(best, hit)
+        return [(identity, accession)
+                for identity, _, accession in sorted(best, reverse=True)]
+    best = None
+    for line in lines:
+        if strategy == "identity":
+            score = float(line[2])
+        else:
+            score = -get_evalue(line)
+        if best is None or score > best[0]:
+            best = (score, float(line[2]), line[1].strip())
+    if strategy == "evalue" and best[0] > 0:
+        # vsearch writes -1 in the e-value column of blast6out
+        raise ValueError("no e-value in the hits of {0} (vsearch output?), "
+                         "use -s identity".format(line[0]))
+    return [best[1:]]
+
+
+def load_vsearch(input_file, strategy="first", top_hits=10):
+    """Load assignation provided with vsearch or blast, the rows of each
+    query are read one query at a time
+      Arguments:
+          input_file: Path to the hits (tabular, grouped by query)
+          strategy: Hit selection (see select_hits)
+          top_hits: Number of hits kept for lca
+      Returns: A HitTable
+    """
+    vsearch_table = HitTable()
     try:
         with open(input_file, "rt") as input_data:
             input_reader = csv.reader(input_data, delimiter='\t')
-            for line in input_reader:
-                annotation = line[1].strip()
-                # Only the best hit
-                if line[0] != OTU_prev:
-                    OTU_prev = line[0]
-                    if annotation in vsearch_dict:
-                        vsearch_dict[annotation] += [[line[0], float(line[2])]]
-                    else:
-                        vsearch_dict[annotation] = [[line[0], float(line[2])]]
-        assert(len(vsearch_dict) > 0)
+            for query, lines in itertools.groupby(input_reader,
+                                                  lambda line: line[0]):
+                vsearch_table.add(query, select_hits(lines, strategy,
+                                                     top_hits))
+        assert(len(vsearch_table.queries) > 0)
     except IOError:
         sys.exit("Error cannot open {0}".format(input_file))
+    except (IndexError, ValueError) as err:
+        sys.exit("Error in {0}: {1}".format(input_file, err))
     except AssertionError:
         sys.exit("Nothing read from {0}".format(input_file))
-    return vsearch_dict
+    return vsearch_table
 
 
-def parse_rdp(header, vsearch_dict, annotation_dict):
+def parse_rdp(header):
     """Parse RDP annotation
+      Returns: The accession and its lineage
     """
-    identified = 0
     tax = header.strip().split(" ")[0][1:]
     lineage = header.strip().split("=")[1]
-    if tax in vsearch_dict:
-        lineage = lineage.split(";")[2:]
-        lineage = [lineage[i].replace("\"","")
-                   for i in xrange(0, len(lineage), 2)]
-        annotation_dict[tax] = ";".join(lineage)
-        identified = 1
-    return annotation_dict, identified
+    lineage = lineage.split(";")[2:]
+    lineage = [lineage[i].replace("\"","")
+               for i in range(0, len(lineage), 2)]
+    return tax, ";".join(lineage)
 
 
-def parse_unite(header, vsearch_dict, annotation_dict):
+def parse_unite(header):
     """Parse unite annotation
+      Returns: The accession and its lineage
     """
-    identified = 0
     header = header.strip()
     tax = header[1:]#.split(" ")[0][1:]
     header = header.replace("|reps|", " ")
@@ -137,169 +301,344 @@ def parse_unite(header, vsearch_dict, annotation_dict):
     header = header.replace("|reps_singleton|", " ")
     header = header.replace("|refs_singleton|", " ")
     lineage = header.split(" ")[1]
-    if tax in vsearch_dict:
-        lineage = lineage.split(";")
-        lineage = [lineage[i].split("_")[2] for i in xrange(0, len(lineage))]
-        annotation_dict[tax] = ";".join(lineage)
-        identified = 1
-    return annotation_dict, identified
+    lineage = lineage.split(";")
+    lineage = [lineage[i].split("_")[2] for i in range(0, len(lineage))]
+    return tax, ";".join(lineage)
 
 
-def parse_findley(header, vsearch_dict, annotation_dict):
+def parse_findley(header):
     """Parse findley database annotations
+      Returns: The accession and its lineage
     """
-    identified = 0
     tax = header.strip().split(" ")
-    #print(tax)
-    if tax[0][1:] in vsearch_dict:
-        annotation_dict[tax[0][1:]] = tax[1].replace("Root;", "")
-        #print(annotation_dict[tax[0][1:]])
-        identified = 1
-    return annotation_dict, identified
+    return tax[0][1:], tax[1].replace("Root;", "")
 
 
-def parse_silva(header, vsearch_dict, annotation_dict):
+def parse_silva(header):
     """Parse silva database annotations
+      Returns: The accession and its lineage
     """
     useless_mention = ["uncultured bacterium", "Incertae", "unidentified",
                        "uncultured organism", "uncultured soil bacterium",
                        "unidentified marine bacterioplankton", "uncultured"]
-    identified = 0
     tax = header.strip().split(" ")
-    if tax[0][1:].strip() in vsearch_dict:
-        #print(header.strip())
-        #print(tax[0][1:].strip())
-        annotation = " ".join(tax[1:])
-        check_taxo = annotation.split(";")
-        annotation = ";".join(["" if annot in useless_mention else annot
-                               for annot in check_taxo ])
-        if check_taxo[0] == "Eukaryota":
-            len_taxo = len(check_taxo)
-            simplified_tax = [check_taxo[0]]
-            if len_taxo >= 4:
-                simplified_tax += [check_taxo[3]]
-            if len_taxo == 8:
-                simplified_tax +=  [check_taxo[7]]
-            elif len_taxo > 8:
-                simplified_tax +=  check_taxo[7:]
-            annotation = ";".join(simplified_tax)
-        #print(annotation)
-        annotation_dict[tax[0][1:].strip()] = annotation
-        #print(annotation_dict[tax[0][1:].strip()])
-        identified = 1
-    return annotation_dict, identified
-
-def parse_greengenes(header, vsearch_dict, annotation_dict):
+    annotation = " ".join(tax[1:])
+    check_taxo = annotation.split(";")
+    annotation = ";".join(["" if annot in useless_mention else annot
+                           for annot in check_taxo ])
+    if check_taxo[0] == "Eukaryota":
+        len_taxo = len(check_taxo)
+        simplified_tax = [check_taxo[0]]
+        if len_taxo >= 4:
+            simplified_tax += [check_taxo[3]]
+        if len_taxo == 8:
+            simplified_tax +=  [check_taxo[7]]
+        elif len_taxo > 8:
+            simplified_tax +=  check_taxo[7:]
+        annotation = ";".join(simplified_tax)
+    return tax[0][1:].strip(), annotation
+
+
+def parse_greengenes(header):
     """Parse greengenes database annotations
+      Returns: The accession and its lineage
     """
-    identified = 0
-    #print(header)
     tax = header.strip().split("\t")
-    #print(tax)
     idname = tax[0][1:].strip()
-    if idname in vsearch_dict:
-        annotation_dict[idname] = "".join([annot[3:]
-                                           for annot in tax[3].split(" ")])
-        identified = 1
-    return annotation_dict, identified
+    return idname, "".join([annot[3:] for annot in tax[3].split(" ")])
+
 
-def parse_underhill(header, vsearch_dict, annotation_dict):
+def parse_underhill(header):
     """Parse underhill database annotations
+      Returns: The accession and its lineage
     """
-    identified = 0
     tax = header.strip().split(" ")
     idname = tax[0][1:].strip()
-    #print(tax)
-    if idname in vsearch_dict:
-        annotation_dict[idname] = ";".join([annot[3:]
-                                           for annot in tax[1].split(";")])
-        identified = 1
-    return annotation_dict, identified
+    return idname, ";".join([annot[3:] for annot in tax[1].split(";")])
 
 
-def load_taxonomy(database_file, vsearch_dict, database_type):
-    """Load rdp and silva annotations
+class LineageStore(object):
+    """Intern the rank names of the lineages, each lineage is a tuple of
+    rank numbers shared by all the accessions with the same lineage.
+    """
+    def __init__(self):
+        self.names = []
+        self.ranks = {}
+        self.lineages = {}
+
+    def add(self, annotation):
+        """Get the interned lineage of an annotation "Kingdom;Phylum;..."
+        """
+        lineage = []
+        for name in annotation.split(";"):
+            rank = self.ranks.get(name)
+            if rank is None:
+                rank = self.ranks[name] = len(self.names)
+                self.names.append(name)
+            lineage.append(rank)
+        lineage = tuple(lineage)
+        return self.lineages.setdefault(lineage, lineage)
+
+    def get_names(self, lineage, length):
+        """Get the names of the first ranks of a lineage
+        """
+        return [self.names[rank] for rank in lineage[:length]]
+
+
+# Header parser of each database format
+PARSERS = {"greengenes": parse_greengenes, "rdp": parse_rdp,
+           "itsdb_unite": parse_unite, "itsdb_findley": parse_findley,
+           "itsdb_underhill": parse_underhill, "silva_lsu": parse_silva,
+           "silva_ssu": parse_silva}
+
+
+def get_accession(header, database_type):
+    """Get the accession of a database header (bytes, without ">") without
+    parsing its lineage
     """
-    annotation_dict = {}
-    # UGLY
     if database_type == "greengenes":
-        parse_result = parse_greengenes
-    elif database_type == "rdp":
-        parse_result = parse_rdp
+        return header.split(b"\t", 1)[0].strip()
     elif database_type == "itsdb_unite":
-        parse_result = parse_unite
-    elif database_type == "itsdb_findley":
-        parse_result = parse_findley
-    elif database_type == "itsdb_underhill":
-        parse_result = parse_underhill
-    else:
-        parse_result = parse_silva
-    nb_id = len(vsearch_dict)
-    count_identified = 0
-    #print(vsearch_dict)
+        return header.strip()
+    return header.strip().split(b" ", 1)[0].strip()
+
+
+def native_str(text):
+    """Get a text as a native string (bytes with Python 2), the bytes that
+    are not UTF-8 are replaced
+    """
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", "replace")
+    if str is bytes:
+        return text.encode("utf-8")
+    return text
+
+
+def read_headers(database_file):
+    """Read the header lines of a fasta database, as unicode for sqlite,
+    the bytes that are not UTF-8 are replaced
+    """
+    with open(database_file, "rb") as database:
+        for line in database:
+            if line.startswith(b">"):
+                yield line.decode("utf-8", "replace")
+
+
+def scan_headers(data):
+    """Get the header lines of a mapped fasta database, without ">", by
+    jumping from one newline followed by ">" to the next
+      Arguments:
+          data: Content of the database (mmap or bytes)
+    """
+    if data[:1] == b">":
+        end = data.find(b"\n")
+        yield data[1:end if end >= 0 else len(data)]
+    for header in HEADER.finditer(data):
+        yield header.group(1)
+
+
+def load_taxonomy(database_file, vsearch_dict, database_type, lineage_store):
+    """Load the lineage of the accessions found by vsearch by reading the
+    headers of the whole database, only the headers of the hits are decoded
+    """
+    annotation_dict = {}
+    parse_result = PARSERS[database_type]
+    hits = set(accession if isinstance(accession, bytes)
+               else accession.encode("utf-8") for accession in vsearch_dict)
     try:
-        with open(database_file, "rt") as database:
-            for line in database:
-                if line.startswith(">"):
-                    annotation_dict, count = parse_result(line, vsearch_dict,
-                                                          annotation_dict)
-                    count_identified += count
-                    if count_identified == nb_id:
-                        break
-    except IOError:
+        with open(database_file, "rb") as database:
+            if not os.fstat(database.fileno()).st_size:
+                return annotation_dict
+            data = mmap.mmap(database.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for header in scan_headers(data):
+                    if get_accession(header, database_type) in hits:
+                        tax, annotation = parse_result(
+                            ">" + native_str(header) + "\n")
+                        annotation_dict[tax] = lineage_store.add(annotation)
+                        if len(annotation_dict) == len(hits):
+                            break
+            finally:
+                data.close()
+    except (IOError, OSError):
         sys.exit("Error cannot open {0}".format(database_file))
     return annotation_dict
 
 
-def write_tax_table(vsearch_dict, annotation_dict, output_file, otu_tab,
-                    biom=False):
+def get_index_file(database_file):
+    """Get the default path of the taxonomy index of a database
+    """
+    return database_file + INDEX_SUFFIX
+
+
+def get_database_stamp(database_file, database_type):
+    """Get the values identifying the version of a database
+    """
+    stat = os.stat(database_file)
+    return [("database_type", database_type), ("size", str(stat.st_size)),
+            ("mtime", "{0:.6f}".format(stat.st_mtime))]
+
+
+def parse_headers(database_file, parse_result):
+    """Parse all the headers of a database, the headers without lineage
+    are skipped
     """
+    for header in read_headers(database_file):
+        try:
+            yield parse_result(header)
+        except IndexError:
+            continue
+
+
+def build_taxonomy_index(database_file, database_type, index_file):
+    """Write the lineage of each accession of the database in a sqlite
+    index, keyed by accession
+    """
+    parse_result = PARSERS[database_type]
+    tmp_file = index_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    connection = sqlite3.connect(tmp_file)
+    try:
+        connection.execute("CREATE TABLE info (key TEXT PRIMARY KEY, "
+                           "value TEXT)")
+        connection.execute("CREATE TABLE taxonomy (accession TEXT PRIMARY "
+                           "KEY, lineage TEXT) WITHOUT ROWID")
+        connection.executemany("INSERT INTO info VALUES (?, ?)",
+                               get_database_stamp(database_file,
+                                                  database_type))
+        connection.executemany("INSERT OR REPLACE INTO taxonomy VALUES (?, ?)",
+                               parse_headers(database_file, parse_result))
+        connection.commit()
+    finally:
+        connection.close()
+    os.rename(tmp_file, index_file)
+
+
+def load_taxonomy_index(index_file, database_file, database_type,
+                        vsearch_dict, lineage_store):
+    """Load the lineage of the accessions found by vsearch from the index
+      Returns: The annotation dict, None if the index does not match the
+               database
+    """
+    annotation_dict = {}
+    connection = sqlite3.connect(index_file)
+    try:
+        info = dict(connection.execute("SELECT key, value FROM info"))
+        if info != dict(get_database_stamp(database_file, database_type)):
+            return None
+        accessions = list(vsearch_dict)
+        # Bounded by the number of sqlite parameters
+        for start in range(0, len(accessions), 500):
+            chunk = accessions[start:start + 500]
+            query = ("SELECT accession, lineage FROM taxonomy WHERE "
+                     "accession IN ({0})".format(",".join("?" * len(chunk))))
+            for accession, annotation in connection.execute(query, chunk):
+                annotation_dict[native_str(accession)] = lineage_store.add(
+                    native_str(annotation))
+    finally:
+        connection.close()
+    return annotation_dict
+
+
+def get_taxonomy(database_file, vsearch_dict, database_type, index_file,
+                 lineage_store):
+    """Load the lineage of the accessions found by vsearch, with the index
+    of the database when it is up to date
+    """
+    if os.path.isfile(index_file):
+        try:
+            annotation_dict = load_taxonomy_index(index_file, database_file,
+                                                  database_type, vsearch_dict,
+                                                  lineage_store)
+            if annotation_dict is not None:
+                return annotation_dict
+            print("{0} does not match {1}, the database is read entirely"
+                  .format(index_file, database_file), file=sys.stderr)
+        except sqlite3.Error as err:
+            print("Cannot read {0} ({1}), the database is read entirely"
+                  .format(index_file, err), file=sys.stderr)
+    return load_taxonomy(database_file, vsearch_dict, database_type,
+                         lineage_store)
+
+
+def get_removed_ranks(identity):
+    """Get the number of ranks removed from the end of the lineage for an
+    identity, None when no rank is kept
     """
     # Identity threshold :
     # Uniting the classification of cultured and uncultured bacteria and archaea using 16S rRNA gene sequences
     # Pablo Yarza,       Pelin Yilmaz,   Elmar Pruesse,  Frank Oliver Glöckner,  Wolfgang Ludwig,        Karl-Heinz Schleifer,   William B. Whitman,     Jean Euzéby,    Rudolf Amann    & Ramon Rosselló-Móra
     # Nature Reviews Microbiology 12, 635–645 (2014) doi:10.1038/nrmicro3330
-    #print(vsearch_dict)
-    #print(annotation_dict)
+    # Genus and the rest
+    if identity >= 94.5:
+        return 0
+    # Family
+    elif identity >= 86.5:
+        return 2
+    # Order
+    elif identity >= 82.0:
+        return 3
+    # Class
+    elif identity >= 78.5:
+        return 4
+    # Phylum
+    elif identity >= 75.0:
+        return 5
+    return None
+
+
+def get_common_length(lineage, other, empty=None):
+    """Get the number of ranks shared by two lineages from the kingdom, up
+    to the first empty rank
+    """
+    length = 0
+    for rank, other_rank in zip(lineage, other):
+        if rank != other_rank or rank == empty:
+            break
+        length += 1
+    return length
+
+
+def write_tax_table(vsearch_table, annotation_dict, output_file, otu_tab,
+                    lineage_store, biom=False):
+    """Write the lineage of each OTU truncated according to its identity,
+    and to the lineage shared by its hits for lca. The rows are built once
+    for each lineage and truncation
+    """
     prefix = ["k__", "p__", "c__", "o__", "f__", "g__", "s__"]
+    rows = {}
+    # Rank number of the empty names, None if there is none
+    empty = lineage_store.ranks.get("")
     try:
         with open(output_file, "wt") as output:
             output_writer = csv.writer(output, delimiter='\t')
             if not biom:
                 output_writer.writerow(["OTU", "Kingdom", "Phylum", "Class",
                                         "Order", "Family", "Genus", "Specie"])
-            for tax in vsearch_dict:
-                #print(tax)
-                for OTU in vsearch_dict[tax]:
-                    #print(OTU)
-                    if OTU[0] in otu_tab:
-                        otu_tab.remove(OTU[0])
-                    taxonomy = annotation_dict[tax].split(";")
-                    # Genus and the rest
-                    if OTU[1] >= 94.5:
-                        pass
-                        #taxonomy = taxonomy[:-1]
-                    # Family
-                    elif OTU[1] < 94.5 and OTU[1] >= 86.5:
-                        taxonomy = taxonomy[:-2]
-                    # Order
-                    elif OTU[1] < 86.5 and OTU[1] >= 82.0:
-                        taxonomy = taxonomy[:-3]
-                    # Class
-                    elif OTU[1] < 82.0 and OTU[1] >= 78.5:
-                        taxonomy = taxonomy[:-4]
-                    # Phylum
-                    elif OTU[1] < 78.5 and OTU[1] >= 75.0:
-                        taxonomy = taxonomy[:-5]
-                    else:
-                        taxonomy = []
+            for query, identity, accessions in vsearch_table.get_queries():
+                tax = accessions[0]
+                lineage = annotation_dict[tax]
+                common = len(lineage)
+                for tax in accessions[1:]:
+                    common = min(common, get_common_length(
+                        lineage, annotation_dict[tax], empty))
+                if query in otu_tab:
+                    otu_tab.remove(query)
+                removed = get_removed_ranks(identity)
+                if removed is None:
+                    length = 0
+                else:
+                    length = min(max(len(lineage) - removed, 0), common)
+                taxonomy = rows.get((lineage, length))
+                if taxonomy is None:
+                    taxonomy = lineage_store.get_names(lineage, length)
                     taxonomy = taxonomy + ['']*(7-len(taxonomy))
                     if biom:
-                        taxonomy = [prefix[level] + taxonomy[level]
-                                    for level in xrange(0, 7)]
-                        taxonomy = [";".join(taxonomy)]
-                        #sys.exit("Strange id is to low for {0[0]} : {0[1]} \%".format(OTU))
-                    output_writer.writerow([OTU[0]] + taxonomy)
+                        taxonomy = [";".join(prefix[level] + taxonomy[level]
+                                             for level in range(0, 7))]
+                    rows[(lineage, length)] = taxonomy
+                output_writer.writerow([query] + taxonomy)
             if len(otu_tab) > 0:
                 empty_prefix = [";".join(prefix)]
                 for otu in otu_tab:
@@ -327,23 +666,132 @@ def get_id(otu_file):
     return otu_tab
 
 
+def load_database(task):
+    """Load the lineage of the accessions of a database, run by the process
+    pool.
+      Arguments:
+          task: (database file, database type, accessions) tuple
+      Returns: The annotation dict, its LineageStore and an error message
+               (None if the database was read)
+    """
+    database_file, database_type, accessions = task
+    lineage_store = LineageStore()
+    try:
+        annotation_dict = get_taxonomy(database_file, accessions,
+                                       database_type,
+                                       get_index_file(database_file),
+                                       lineage_store)
+    except SystemExit as err:
+        return None, None, str(err)
+    return annotation_dict, lineage_store, None
+
+
+def annotate_jobs(jobs, otu_file, threads=1, strategy="first", top_hits=10):
+    """Annotate several hit files against several databases, the databases
+    are read in a process pool. A failing job does not stop the others.
+      Arguments:
+          jobs: List of (hits, database, dtype, output, biom output) tuples
+          otu_file: Path to the OTU fasta file (for biom output only)
+          threads: Number of processes
+          strategy: Hit selection (see select_hits)
+          top_hits: Number of hits kept for lca
+    """
+    errors = collections.OrderedDict()
+    # Each hit file is loaded once
+    hits = {}
+    for hits_file, _, _, _, _ in jobs:
+        if hits_file not in hits and hits_file not in errors:
+            try:
+                hits[hits_file] = load_vsearch(hits_file, strategy, top_hits)
+            except SystemExit as err:
+                errors[hits_file] = str(err)
+    # Each database is read once for the hits of all its jobs
+    databases = collections.OrderedDict()
+    for hits_file, database_file, database_type, _, _ in jobs:
+        if hits_file in hits:
+            databases.setdefault((database_file, database_type),
+                                 set()).update(hits[hits_file])
+    tasks = [key + (accessions,) for key, accessions in databases.items()]
+    pool = None
+    if threads > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(threads, len(tasks)))
+        results = pool.imap(load_database, tasks)
+    else:
+        results = map(load_database, tasks)
+    annotations = {}
+    try:
+        for key, (annotation_dict, lineage_store, error) in zip(databases,
+                                                                results):
+            if error:
+                errors[key] = error
+            else:
+                annotations[key] = (annotation_dict, lineage_store)
+        if pool:
+            pool.close()
+            pool.join()
+    finally:
+        if pool:
+            pool.terminate()
+    otu_tab = None
+    for (hits_file, database_file, database_type, output_file,
+         output_file_biom) in jobs:
+        if (hits_file not in hits or
+                (database_file, database_type) not in annotations):
+            continue
+        annotation_dict, lineage_store = annotations[(database_file,
+                                                      database_type)]
+        try:
+            write_tax_table(hits[hits_file], annotation_dict, output_file, [],
+                            lineage_store)
+            if output_file_biom:
+                if not otu_file:
+                    sys.exit("Please provide OTU fasta file")
+                if otu_tab is None:
+                    otu_tab = get_id(otu_file)
+                write_tax_table(hits[hits_file], annotation_dict,
+                                output_file_biom, list(otu_tab),
+                                lineage_store, True)
+        except SystemExit as err:
+            errors[output_file] = str(err)
+    if errors:
+        sys.exit("\n".join(errors.values()))
+
+
 def main():
     """Main program
     """
     args = getArguments()
-    vsearch_dict = load_vsearch(args.input_file)
+    if args.jobs:
+        annotate_jobs(args.jobs, args.otu_file, args.threads, args.strategy,
+                      args.top_hits)
+        return
+    if not args.index_file:
+        args.index_file = get_index_file(args.database_file)
+    if args.build_index:
+        try:
+            build_taxonomy_index(args.database_file, args.database_type,
+                                 args.index_file)
+        except (IOError, OSError, sqlite3.Error) as err:
+            sys.exit("Error cannot build {0}: {1}".format(args.index_file,
+                                                          err))
+        return
+    vsearch_table = load_vsearch(args.input_file, args.strategy,
+                                 args.top_hits)
     # Load database annotation
-    annotation_dict = load_taxonomy(args.database_file, vsearch_dict,
-                                    args.database_type)
+    lineage_store = LineageStore()
+    annotation_dict = get_taxonomy(args.database_file, vsearch_table,
+                                   args.database_type, args.index_file,
+                                   lineage_store)
     # write result
-    write_tax_table(vsearch_dict, annotation_dict, args.output_file, [])
+    write_tax_table(vsearch_table, annotation_dict, args.output_file, [],
+                    lineage_store)
     if args.output_file_biom:
         if args.otu_file:
             otu_tab = get_id(args.otu_file)
         else:
             sys.exit("Please provide OTU fasta file")
-        write_tax_table(vsearch_dict, annotation_dict, args.output_file_biom,
-                        otu_tab, True)
+        write_tax_table(vsearch_table, annotation_dict, args.output_file_biom,
+                        otu_tab, lineage_store, True)
 
 
 if __name__ == '__main__':
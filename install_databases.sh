@@ -132,6 +132,18 @@ iconv -c -f utf-8 -t ascii//TRANSLIT $databases_dir/sh_general_release_dynamic_s
 mv $databases_dir/sh_general_release_dynamic_s_20.11.2016.fasta_ascii $databases_dir/sh_general_release_dynamic_s_20.11.2016.fasta
 say "Elapsed time for Unite database: $(timer $start_time)"
 
+# Taxonomy indexing
+say "Indexing databases for get_taxonomy"
+start_time=$(timer)
+get_taxonomy="$SCRIPTPATH/get_taxonomy/get_taxonomy.py"
+python $get_taxonomy --build_index -d $databases_dir/SILVA_128_SSURef_Nr99_tax_silva.fasta -dtype silva_ssu
+python $get_taxonomy --build_index -d $databases_dir/SILVA_128_LSURef_tax_silva.fasta -dtype silva_lsu
+python $get_taxonomy --build_index -d $databases_dir/gg_13_5.fasta -dtype greengenes
+python $get_taxonomy --build_index -d $databases_dir/sh_general_release_dynamic_s_20.11.2016.fasta -dtype itsdb_unite
+python $get_taxonomy --build_index -d $databases_dir/ITSdb.findley.fasta -dtype itsdb_findley
+python $get_taxonomy --build_index -d $databases_dir/THFv1.3.sequence.fasta -dtype itsdb_underhill
+say "Elapsed time to index for get_taxonomy: $(timer $start_time)"
+
 # Blast indexing
 say "Indexing databases for blast"
 start_time=$(timer)
@@ -138,6 +138,7 @@ display_help() {
         printf "%-25s %-30s\n" "--prefixdrep" "Perform prefix dereplication (Default: full length dereplication)"
         printf "%-25s %-30s\n" "--chimeraslayerfiltering" "Use ChimeraSlayer database for chimera filtering (Default Perform a de novo chimera filtering)"
         printf "%-25s %-30s\n" "--otudiffswarm" "Number of difference accepted in an OTU with swarm (Default 1)"
+        printf "%-25s %-30s\n" "--swarmcount" "Count the reads of each OTU from the swarm clusters by exact match instead of mapping the reads on the OTU with vsearch (Default: mapping). The reads removed by the size, length and chimera filtering are not counted"
         printf "%-25s %-30s\n" "--evalueTaxAnnot" "Evalue threshold for taxonomical annotation with blast (Default evalue=1E-5)"
         printf "%-25s %-30s\n" "--maxTargetSeqs" "Number of hit per OTU with blast (Default 1)"
         printf "%-25s %-30s\n" "--identityThreshold" "Identity threshold for taxonomical annotation with vsearch (Default 0.75)"
@@ -197,6 +198,10 @@ Minimum size of an OTU for singleton removal [--minotusize]= $minotusize""" >&2
     then
         echo """Clustering is performed with swarm [-s]
 Number of difference accepted in an OTU with swarm [--otudiffswarm]= $otudiffswarm""">&2
+        if [ "$swarm_count" -eq "1" ]
+        then
+            echo "OTU table is counted from the swarm clusters [--swarmcount]" >&2
+        fi
     else
         echo "Clustering is performed with vsearch" >&2
     fi
@@ -303,6 +308,7 @@ paired=0
 prefixdrep=0
 ProjectName=""
 swarm_clust=0
+swarm_count=0
 
 ############
 # Programs #
@@ -323,6 +329,8 @@ extract_fasta="$SCRIPTPATH/extract_fasta/extract_fasta.py"
 extract_result="$SCRIPTPATH/extract_result/extract_result.py"
 # Fastq2fasta
 fastq2fasta="$SCRIPTPATH/fastq2fasta/fastq2fasta.py"
+# Trim, filter and convert single-end reads
+trim_filter_fasta="$SCRIPTPATH/fastq2fasta/trim_filter_fasta.py"
 # Fastqc
 fastqc=$(check_soft "fastqc" "$SCRIPTPATH/FastQC/fastqc")
 # Fasttree
@@ -358,7 +366,7 @@ vsearch=$(check_soft "vsearch" "$SCRIPTPATH/vsearch_bin/bin/vsearch")
 # Main #
 ########
 # Execute getopt on the arguments passed to this program, identified by the special character $@
-PARSED_OPTIONS=$(getopt -n "$0"  -o hi:o:r:t:a:sblfn:c: --long "help,input_dir:,output:,thread:,minampliconlength:,maxoverlap:,maxTargetSeqs:,minotusize:,minoverlap:,minphred:,minphredperc:,minreadlength:,identityThreshold:,evalueTaxAnnot:,NbMismatchMapping:,amplicon:,swarm,blast,fungi,name:,prefixdrep,chimeraslayerfiltering,conservedPosition:,accurateTree,contaminant:"  -- "$@")
+PARSED_OPTIONS=$(getopt -n "$0"  -o hi:o:r:t:a:sblfn:c: --long "help,input_dir:,output:,thread:,minampliconlength:,maxoverlap:,maxTargetSeqs:,minotusize:,minoverlap:,minphred:,minphredperc:,minreadlength:,identityThreshold:,evalueTaxAnnot:,NbMismatchMapping:,amplicon:,swarm,blast,fungi,name:,prefixdrep,swarmcount,chimeraslayerfiltering,conservedPosition:,accurateTree,contaminant:"  -- "$@")
 
 #Check arguments
 if [ $# -eq 0 ]
@@ -460,6 +468,9 @@ do
     --prefixdrep)
         prefixdrep=1
         shift ;;
+    --swarmcount)
+        swarm_count=1
+        shift ;;
     --identityThreshold)
         identityThreshold=$2
         shift 2;;
@@ -533,12 +544,18 @@ all_start_time=$(timer)
 if [ -d "$input_dir" ]
 then
     list_product_fa=""
+    # Samples converted at once by fastq2fasta after the read processing
+    fastq2fasta_manifest="${readsDir}/fastq2fasta_manifest.txt"
+    rm -f $fastq2fasta_manifest
+    # Read statistics are only used by extract_result for single-end reads
+    fastq2fasta_stats=""
 
     nb_samples=$(ls $input_dir/*{-,.,_}R1*.{fastq,fq,fastq.gz,fq.gz} -1  2>/dev/null |wc -l)
     num_sample=0
     if [ "$nb_samples" -eq "0" ]
     then
         nb_samples=$(ls $input_dir/*.{fastq,fq,fastq.gz,fq.gz} -1  2>/dev/null |wc -l)
+        fastq2fasta_stats="--stats"
         for input in $(ls $input_dir/*.{fastq,fq,fastq.gz,fq.gz}  2>/dev/null )
         do
             let "num_sample=$num_sample+1"
@@ -547,6 +564,32 @@ then
             SampleName="${filename%.*}"
             check_name $SampleName
             list_product_fa+="${resultDir}/reads/${SampleName}_alien_filt.fasta "
+            # Trim, filter and convert the reads in a single pass on a new sample
+            if [ -f "$input" ] && [ ! -f "${readsDir}/${SampleName}_alien.fastq" ] && [ ! -f "${readsDir}/${SampleName}_alien_filt.fastq" ] && [ ! -f "${readsDir}/${SampleName}_${contaminant[0]}_0.fastq" ]
+            then
+                say "$num_sample/$nb_samples - Trim, filter and convert reads with trim_filter_fasta"
+                start_time=$(timer)
+                contaminant_opt=""
+                essai=0
+                for db in ${contaminant[@]}
+                do
+                    # Set to lowercase
+                    db=$(echo "${db,,}")
+                    if [ "${filterRef[$db]}" == "" ]
+                    then
+                        error "$db does not belong to the list of possible contaminant [danio,human,mouse,mosquito,phi]"
+                        exit 1
+                    fi
+                    contaminant_opt+="-x ${contaminant[${essai}]}=${filterRef[$db]} "
+                    let "essai=$essai+1";
+                done
+                $trim_filter_fasta -i $input -s ${SampleName} -o ${readsDir}/${SampleName}_alien_filt.fasta -f ${readsDir}/${SampleName}_alien_filt.fastq --stats -c $alienseq -l $minreadlength -p $minphredperc -q $minphred -N $NbMismatchMapping -t $NbProc $contaminant_opt -d ${logDir} -e ${errorlogDir} --alientrimmer "$alientrimmer" --bowtie2 "$bowtie2" 2> ${errorlogDir}/error_log_trim_filter_fasta_${SampleName}.txt
+                check_file ${readsDir}/${SampleName}_alien_filt.fasta
+                check_file ${readsDir}/${SampleName}_alien_filt.fastq
+                check_log ${errorlogDir}/error_log_trim_filter_fasta_${SampleName}.txt
+                check_log ${errorlogDir}/error_log_alientrimmer_${SampleName}.txt
+                say "$num_sample/$nb_samples - Elapsed time with trim_filter_fasta: $(timer $start_time)"
+            fi
             # Triming
             if [ -f "$input" ] && [ ! -f "${readsDir}/${SampleName}_alien.fastq" ] && [ ! -f "${readsDir}/${SampleName}_alien_filt.fastq" ]
             then
@@ -619,12 +662,7 @@ then
             # Convert to fasta with the right name
             if [ -f "${readsDir}/${SampleName}_alien_filt.fastq" ] && [ ! -f "${readsDir}/${SampleName}_alien_filt.fasta" ]
             then
-                say "$num_sample/$nb_samples - Convert fastq to fasta with fastq2fasta"
-                start_time=$(timer)
-                $fastq2fasta -i ${readsDir}/${SampleName}_alien_filt.fastq -o ${readsDir}/${SampleName}_alien_filt.fasta -s ${SampleName}  2> ${errorlogDir}/error_log_fastq2fasta_${SampleName}.txt
-                check_file ${readsDir}/${SampleName}_alien_filt.fasta
-                check_log ${errorlogDir}/error_log_fastq2fasta_${SampleName}.txt
-                say "$num_sample/$nb_samples - Elapsed time with fastq2fasta: $(timer $start_time)"
+                echo -e "${readsDir}/${SampleName}_alien_filt.fastq\t${SampleName}\t${readsDir}/${SampleName}_alien_filt.fasta" >> $fastq2fasta_manifest
             fi
         done
     else
@@ -739,15 +777,30 @@ then
             # Convert to fasta with the right name
             if [ -f "${readsDir}/${SampleName}.extendedFrags.fastq" ] && [ ! -f "${readsDir}/${SampleName}_extendedFrags.fasta" ]
             then
-                say "$num_sample/$nb_samples - Convert fastq to fasta with fastq2fasta"
-                start_time=$(timer)
-                $fastq2fasta -i ${readsDir}/${SampleName}.extendedFrags.fastq -o ${readsDir}/${SampleName}_extendedFrags.fasta -s ${SampleName}  2> ${errorlogDir}/error_log_fastq2fasta_${SampleName}.txt
-                check_file ${readsDir}/${SampleName}_extendedFrags.fasta
-                check_log ${errorlogDir}/error_log_fastq2fasta_${SampleName}.txt
-                say "$num_sample/$nb_samples - Elapsed time with fastq2fasta: $(timer $start_time)"
+                echo -e "${readsDir}/${SampleName}.extendedFrags.fastq\t${SampleName}\t${readsDir}/${SampleName}_extendedFrags.fasta" >> $fastq2fasta_manifest
             fi
         done
     fi
+    # Convert all the samples to fasta with the right name
+    if [ -f "$fastq2fasta_manifest" ]
+    then
+        say "Convert fastq to fasta with fastq2fasta"
+        start_time=$(timer)
+        # Write directly the amplicon file when every sample is converted
+        amplicon_opt=""
+        if [ ! -f "$amplicon" ] && [ "$(wc -l < $fastq2fasta_manifest)" -eq "$num_sample" ]
+        then
+            amplicon_opt="-a $amplicon"
+        fi
+        $fastq2fasta -m $fastq2fasta_manifest -t $NbProc $fastq2fasta_stats $amplicon_opt 2> ${errorlogDir}/error_log_fastq2fasta.txt
+        for product_fa in $list_product_fa
+        do
+            check_file $product_fa
+        done
+        check_log ${errorlogDir}/error_log_fastq2fasta.txt
+        rm -f $fastq2fasta_manifest
+        say "Elapsed time with fastq2fasta: $(timer $start_time)"
+    fi
     say "Elapsed time with read processing: $(timer $all_start_time)"
 fi
 # Combine all files
@@ -821,7 +874,7 @@ then
      #$usearch -cluster_otus ${resultDir}/${ProjectName}_sorted.fasta -otus ${resultDir}/${ProjectName}_otu.fasta -uparseout ${resultDir}/${ProjectName}_uparse.txt -relabel OTU_ -sizein #-sizeout
      # --relabel OTU_
      $vsearch --cluster_size ${resultDir}/${ProjectName}_nochim.fasta --id 0.97 --centroids ${resultDir}/${ProjectName}_otu_compl.fasta --sizein --strand both #--sizeout
-     python $rename_otu -i ${resultDir}/${ProjectName}_otu_compl.fasta -o ${resultDir}/${ProjectName}_otu.fasta
+     python $rename_otu -i ${resultDir}/${ProjectName}_otu_compl.fasta -o ${resultDir}/${ProjectName}_otu.fasta -m ${resultDir}/${ProjectName}_otu_mapping.tsv
      check_file ${resultDir}/${ProjectName}_otu.fasta
      say "Elapsed time to OTU clustering with vsearch: $(timer $start_time)"
 fi
@@ -839,7 +892,15 @@ if [ -f "${resultDir}/${ProjectName}_otu_compl.fasta" ] && [ ! -f "${resultDir}/
 then
      say "Extract OTU clustering with swarm2vsearch"
      start_time=$(timer)
-     python $swarm2vsearch -i ${resultDir}/${ProjectName}_otu_compl.fasta   -c ${resultDir}/${ProjectName}_swarm_clustering.txt -o ${resultDir}/${ProjectName}_otu.fasta -oc ${resultDir}/${ProjectName}_otu_swarm_clustering.txt -u ${resultDir}/${ProjectName}_swarm_uclust.txt -ou ${resultDir}/${ProjectName}_otu_swarm_uclust.txt
+     # Count the reads of each OTU from the swarm clusters instead of
+     # mapping the reads back (exact dereplication only). The reads of the
+     # sequences removed before the clustering are not counted.
+     otu_table_opt=""
+     if [ "$swarm_count" -eq "1" ] && [ "$prefixdrep" -eq "0" ] && [ -f "$amplicon" ]
+     then
+        otu_table_opt="-a $amplicon -d ${resultDir}/${ProjectName}_nochim.fasta -ot ${resultDir}/${ProjectName}_otu_table.tsv -ob ${resultDir}/${ProjectName}_count.biom"
+     fi
+     python $swarm2vsearch -s -t $NbProc -i ${resultDir}/${ProjectName}_otu_compl.fasta -c ${resultDir}/${ProjectName}_swarm_clustering.txt -o ${resultDir}/${ProjectName}_otu.fasta -oc ${resultDir}/${ProjectName}_otu_swarm_clustering.txt -u ${resultDir}/${ProjectName}_swarm_uclust.txt -ou ${resultDir}/${ProjectName}_otu_swarm_uclust.txt $otu_table_opt
      check_file ${resultDir}/${ProjectName}_otu.fasta
      say "Elapsed time with swarm2vsearch: $(timer $start_time)"
 fi
@@ -917,27 +978,6 @@ then
         #check_file ${resultDir}/${ProjectName}_vs_silva_id_${identityThreshold}.tsv
         say "Elapsed time with vsearch: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_vs_silva_id_${identityThreshold}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.tsv" ]
-    then
-        say "Extract vsearch - silva annotation with get_taxonomy"
-        start_time=$(timer)
-        if [ "$lsu" -eq "1" ]
-        then
-            python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_silva_id_${identityThreshold}.tsv -u ${resultDir}/${ProjectName}_otu.fasta -d $silvalsu -o ${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.tsv -ob ${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.biomtsv
-        else
-            python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_silva_id_${identityThreshold}.tsv -u ${resultDir}/${ProjectName}_otu.fasta -d $silva -o ${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.tsv -ob ${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.biomtsv
-        fi
-        #check_file ${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.tsv
-        say "Elapsed time with get_taxonomy: $(timer $start_time)"
-    fi
-    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_silva_id_${identityThreshold}.biom" ]
-    then
-        say "Build vsearch-silva biom"
-        start_time=$(timer)
-        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_silva_id_${identityThreshold}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
-        check_file ${resultDir}/${ProjectName}_silva_id_${identityThreshold}.biom
-        say "Elapsed time to build vsearch-silva biom: $(timer $start_time)"
-    fi
     if [ ! -f "${resultDir}/${ProjectName}_vs_silva_eval_${evalueTaxAnnot}.tsv" ] && [ "$blast_tax" -eq "1" ]  && [ "$fungi" -eq "0" ]
     then
         say "Assign taxonomy against silva with blast"
@@ -951,27 +991,6 @@ then
         #check_file ${resultDir}/${ProjectName}_vs_silva_eval_${evalueTaxAnnot}.tsv
         say "Elapsed time with blast: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_vs_silva_eval_${evalueTaxAnnot}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.tsv" ]
-    then
-        say "Extract silva annotation with get_taxonomy"
-        start_time=$(timer)
-        if [ "$lsu" -eq "1" ]
-        then
-            python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_silva_eval_${evalueTaxAnnot}.tsv -d $silvalsu -u ${resultDir}/${ProjectName}_otu.fasta -o ${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.tsv -ob ${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.biomtsv
-        else
-            python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_silva_eval_${evalueTaxAnnot}.tsv -d $silva -u ${resultDir}/${ProjectName}_otu.fasta -o ${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.tsv -ob ${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.biomtsv
-        fi
-        #check_file ${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.tsv
-        say "Elapsed time with get_taxonomy: $(timer $start_time)"
-    fi
-    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_silva_eval_${evalueTaxAnnot}.biom" ]
-    then
-        say "Build blast-silva biom"
-        start_time=$(timer)
-        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_silva_eval_${evalueTaxAnnot}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
-        check_file ${resultDir}/${ProjectName}_silva_eval_${evalueTaxAnnot}.biom
-        say "Elapsed time to build blast-silva biom: $(timer $start_time)"
-    fi
     # Greengenes
     if [ ! -f "${resultDir}/${ProjectName}_vs_greengenes_id_${identityThreshold}.tsv" ] && [ "$blast_tax" -eq "0" ] && [ "$fungi" -eq "0" ] && [ "$lsu" -eq "0" ]
     then
@@ -981,22 +1000,6 @@ then
         #check_file ${resultDir}/${ProjectName}_vs_greengenes_id_${identityThreshold}.tsv
         say "Elapsed time with vsearch: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_vs_greengenes_id_${identityThreshold}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_greengenes_annotation_id_${identityThreshold}.tsv" ]
-    then
-        say "Extract vsearch - greengenes annotation with get_taxonomy"
-        start_time=$(timer)
-        python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_greengenes_id_${identityThreshold}.tsv -d $greengenes -o ${resultDir}/${ProjectName}_vs_greengenes_annotation_id_${identityThreshold}.tsv -dtype greengenes -ob ${resultDir}/${ProjectName}_vs_greengenes_annotation_id_${identityThreshold}.biomtsv -u ${resultDir}/${ProjectName}_otu.fasta
-        #check_file ${resultDir}/${ProjectName}_vs_greengenes_annotation_id_${identityThreshold}.tsv
-        say "Elapsed time with vsearch: $(timer $start_time)"
-    fi
-    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_greengenes_annotation_id_${identityThreshold}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_greengenes_id_${identityThreshold}.biom" ]
-    then
-        say "Build vsearch-greengenes biom"
-        start_time=$(timer)
-        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_greengenes_id_${identityThreshold}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_greengenes_annotation_id_${identityThreshold}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
-        check_file ${resultDir}/${ProjectName}_greengenes_id_${identityThreshold}.biom
-        say "Elapsed time to build vsearch-greengenes biom: $(timer $start_time)"
-    fi
     if [ ! -f "${resultDir}/${ProjectName}_vs_greengenes_eval_${evalueTaxAnnot}.tsv" ] && [ "$blast_tax" -eq "1" ] && [ "$fungi" -eq "0" ] && [ "$lsu" -eq "0" ]
     then
         say "Assign taxonomy against greengenes with blast"
@@ -1005,86 +1008,130 @@ then
         #check_file ${resultDir}/${ProjectName}_vs_greengenes_eval_${evalueTaxAnnot}.tsv
         say "Elapsed time with blast: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_vs_greengenes_eval_${evalueTaxAnnot}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_greengenes_annotation_eval_${evalueTaxAnnot}.tsv" ]
+    if [ ! -f "${resultDir}/${ProjectName}_vs_findley_id_${identityThreshold}.tsv" ] && [ "$blast_tax" -eq "0" ] && [ "$fungi" -eq "1" ]
     then
-        say "Extract greengenes annotation with get_taxonomy"
+        say "Assign taxonomy against findley with vsearch"
         start_time=$(timer)
-        python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_greengenes_eval_${evalueTaxAnnot}.tsv -d $greengenes -u ${resultDir}/${ProjectName}_otu.fasta -o ${resultDir}/${ProjectName}_vs_greengenes_annotation_eval_${evalueTaxAnnot}.tsv -dtype greengenes -ob ${resultDir}/${ProjectName}_vs_greengenes_annotation_eval_${evalueTaxAnnot}.biomtsv
-        #check_file ${resultDir}/${ProjectName}_vs_greengenes_annotation_eval_${evalueTaxAnnot}.tsv
-        say "Elapsed time with get_taxonomy: $(timer $start_time)"
+        $vsearch --usearch_global ${resultDir}/${ProjectName}_otu.fasta --db $findley --id $identityThreshold --blast6out ${resultDir}/${ProjectName}_vs_findley_id_${identityThreshold}.tsv --strand both
+        #check_file ${resultDir}/${ProjectName}_vs_findley_id_${identityThreshold}.tsv
+        say "Elapsed time with vsearch: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_greengenes_annotation_eval_${evalueTaxAnnot}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_greengenes_eval_${evalueTaxAnnot}.biom" ]
+    if [ ! -f "${resultDir}/${ProjectName}_vs_findley_eval_${evalueTaxAnnot}.tsv" ] && [ "$blast_tax" -eq "1" ] && [ "$fungi" -eq "1" ]
     then
-        say "Build blast-greengenes biom"
+        say "Assign taxonomy against findley with blast"
         start_time=$(timer)
-        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_greengenes_eval_${evalueTaxAnnot}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_greengenes_annotation_eval_${evalueTaxAnnot}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
-        check_file ${resultDir}/${ProjectName}_greengenes_eval_${evalueTaxAnnot}.biom
-        say "Elapsed time to build blast-greengenes biom: $(timer $start_time)"
+        $blastn -query ${resultDir}/${ProjectName}_otu.fasta -db $findley -evalue $evalueTaxAnnot -num_threads $NbProc -out ${resultDir}/${ProjectName}_vs_findley_eval_${evalueTaxAnnot}.tsv -max_target_seqs $maxTargetSeqs -task megablast -outfmt "6 qseqid sseqid  pident qcovs evalue" -use_index true
+        #check_file ${resultDir}/${ProjectName}_vs_findley_eval_${evalueTaxAnnot}.tsv
+        say "Elapsed time with blast: $(timer $start_time)"
     fi
-    if [ ! -f "${resultDir}/${ProjectName}_vs_findley_id_${identityThreshold}.tsv" ] && [ "$blast_tax" -eq "0" ] && [ "$fungi" -eq "1" ]
+    # UNITE
+    if [ ! -f "${resultDir}/${ProjectName}_vs_unite_id_${identityThreshold}.tsv" ] && [ "$blast_tax" -eq "0" ] && [ "$fungi" -eq "1" ]
     then
-        say "Assign taxonomy against findley with vsearch"
+        say "Assign taxonomy against unite with vsearch"
         start_time=$(timer)
-        $vsearch --usearch_global ${resultDir}/${ProjectName}_otu.fasta --db $findley --id $identityThreshold --blast6out ${resultDir}/${ProjectName}_vs_findley_id_${identityThreshold}.tsv --strand both
-        #check_file ${resultDir}/${ProjectName}_vs_findley_id_${identityThreshold}.tsv
+        $vsearch --usearch_global ${resultDir}/${ProjectName}_otu.fasta --db $unite --id $identityThreshold --blast6out ${resultDir}/${ProjectName}_vs_unite_id_${identityThreshold}.tsv --strand both
+        #check_file ${resultDir}/${ProjectName}_vs_unite_id_${identityThreshold}.tsv
         say "Elapsed time with vsearch: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_vs_findley_id_${identityThreshold}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_findley_annotation_id_${identityThreshold}.tsv" ]
+    if [ ! -f "${resultDir}/${ProjectName}_vs_unite_eval_${evalueTaxAnnot}.tsv" ] && [ "$blast_tax" -eq "1" ] && [ "$fungi" -eq "1" ]
+    then
+         say "Assign taxonomy against unite with blast"
+         start_time=$(timer)
+         $blastn -query ${resultDir}/${ProjectName}_otu.fasta -db $unite -evalue $evalueTaxAnnot -num_threads $NbProc -out ${resultDir}/${ProjectName}_vs_unite_eval_${evalueTaxAnnot}.tsv -max_target_seqs $maxTargetSeqs -task megablast -outfmt "6 qseqid sseqid  pident qcovs evalue" -use_index true
+         #check_file ${resultDir}/${ProjectName}_vs_unite_eval_${evalueTaxAnnot}.tsv
+         say "Elapsed time with blast: $(timer $start_time)"
+    fi
+    #Underhill
+    if [ ! -f "${resultDir}/${ProjectName}_vs_underhill_id_${identityThreshold}.tsv" ] && [ "$blast_tax" -eq "0" ] && [ "$fungi" -eq "1" ]
     then
-        say "Extract vsearch - findley annotation with get_taxonomy"
+        say "Assign taxonomy against underhill with vsearch"
         start_time=$(timer)
-        python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_findley_id_${identityThreshold}.tsv -d $findley  -u ${resultDir}/${ProjectName}_otu.fasta -o ${resultDir}/${ProjectName}_vs_findley_annotation_id_${identityThreshold}.tsv -ob ${resultDir}/${ProjectName}_vs_findley_annotation_id_${identityThreshold}.biomtsv  -dtype findley
-        #check_file ${resultDir}/${ProjectName}_vs_findley_annotation_id_${identityThreshold}.tsv
+        $vsearch --usearch_global ${resultDir}/${ProjectName}_otu.fasta --db $underhill --id $identityThreshold --blast6out ${resultDir}/${ProjectName}_vs_underhill_id_${identityThreshold}.tsv --strand both
+        #check_file ${resultDir}/${ProjectName}_vs_underhill_id_${identityThreshold}.tsv
         say "Elapsed time with vsearch: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_findley_annotation_id_${identityThreshold}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_findley_id_${identityThreshold}.biom" ]
+    if [ ! -f "${resultDir}/${ProjectName}_vs_underhill_eval_${evalueTaxAnnot}.tsv" ] && [ "$blast_tax" -eq "1" ] && [ "$fungi" -eq "1" ]
     then
-        say "Build vsearch-findley biom"
+         say "Assign taxonomy against underhill with blast"
+         start_time=$(timer)
+         $blastn -query ${resultDir}/${ProjectName}_otu.fasta -db $underhill -evalue $evalueTaxAnnot -num_threads $NbProc -out ${resultDir}/${ProjectName}_vs_underhill_eval_${evalueTaxAnnot}.tsv -max_target_seqs $maxTargetSeqs -task megablast -outfmt "6 qseqid sseqid  pident qcovs evalue" -use_index true
+         #check_file ${resultDir}/${ProjectName}_vs_underhill_eval_${evalueTaxAnnot}.tsv
+         say "Elapsed time with blast: $(timer $start_time)"
+    fi
+    # Annotate the hits against all the databases in one get_taxonomy call
+    if [ "$lsu" -eq "1" ]
+    then
+        silva_db="$silvalsu:silva_lsu"
+    else
+        silva_db="$silva:silva_ssu"
+    fi
+    taxonomy_jobs=""
+    for taxonomy_db in silva:$silva_db greengenes:$greengenes:greengenes findley:$findley:itsdb_findley unite:$unite:itsdb_unite underhill:$underhill:itsdb_underhill
+    do
+        soft=${taxonomy_db%%:*}
+        for search in id_${identityThreshold} eval_${evalueTaxAnnot}
+        do
+            annotation="${resultDir}/${ProjectName}_vs_${soft}_annotation_${search}"
+            if [ -f "${resultDir}/${ProjectName}_vs_${soft}_${search}.tsv" ] && [ ! -f "${annotation}.tsv" ]
+            then
+                taxonomy_jobs="$taxonomy_jobs -j ${resultDir}/${ProjectName}_vs_${soft}_${search}.tsv:${taxonomy_db#*:}:${annotation}.tsv:${annotation}.biomtsv"
+            fi
+        done
+    done
+    if [ "$taxonomy_jobs" != "" ]
+    then
+        say "Extract the annotations with get_taxonomy"
         start_time=$(timer)
-        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_findley_id_${identityThreshold}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_findley_annotation_id_${identityThreshold}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
-        check_file ${resultDir}/${ProjectName}_findley_id_${identityThreshold}.biom
-        say "Elapsed time to build vsearch-findley biom: $(timer $start_time)"
+        python $get_taxonomy -t $NbProc -u ${resultDir}/${ProjectName}_otu.fasta $taxonomy_jobs
+        say "Elapsed time with get_taxonomy: $(timer $start_time)"
     fi
-    if [ ! -f "${resultDir}/${ProjectName}_vs_findley_eval_${evalueTaxAnnot}.tsv" ] && [ "$blast_tax" -eq "1" ] && [ "$fungi" -eq "1" ]
+    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_silva_id_${identityThreshold}.biom" ]
     then
-        say "Assign taxonomy against findley with blast"
+        say "Build vsearch-silva biom"
         start_time=$(timer)
-        $blastn -query ${resultDir}/${ProjectName}_otu.fasta -db $findley -evalue $evalueTaxAnnot -num_threads $NbProc -out ${resultDir}/${ProjectName}_vs_findley_eval_${evalueTaxAnnot}.tsv -max_target_seqs $maxTargetSeqs -task megablast -outfmt "6 qseqid sseqid  pident qcovs evalue" -use_index true
-        #check_file ${resultDir}/${ProjectName}_vs_findley_eval_${evalueTaxAnnot}.tsv
-        say "Elapsed time with blast: $(timer $start_time)"
+        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_silva_id_${identityThreshold}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_silva_annotation_id_${identityThreshold}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
+        check_file ${resultDir}/${ProjectName}_silva_id_${identityThreshold}.biom
+        say "Elapsed time to build vsearch-silva biom: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_vs_findley_eval_${evalueTaxAnnot}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_findley_annotation_eval_${evalueTaxAnnot}.tsv" ]
+    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_silva_eval_${evalueTaxAnnot}.biom" ]
     then
-        say "Extract findley annotation with get_taxonomy"
+        say "Build blast-silva biom"
         start_time=$(timer)
-        python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_findley_eval_${evalueTaxAnnot}.tsv -d $findley -u  ${resultDir}/${ProjectName}_otu.fasta  -o ${resultDir}/${ProjectName}_vs_findley_annotation_eval_${evalueTaxAnnot}.tsv -ob ${resultDir}/${ProjectName}_vs_findley_annotation_eval_${evalueTaxAnnot}.biomtsv -dtype findley
-        #check_file ${resultDir}/${ProjectName}_vs_findley_annotation_eval_${evalueTaxAnnot}.tsv
-        say "Elapsed time with get_taxonomy: $(timer $start_time)"
+        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_silva_eval_${evalueTaxAnnot}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_silva_annotation_eval_${evalueTaxAnnot}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
+        check_file ${resultDir}/${ProjectName}_silva_eval_${evalueTaxAnnot}.biom
+        say "Elapsed time to build blast-silva biom: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_findley_annotation_eval_${evalueTaxAnnot}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_findley_eval_${evalueTaxAnnot}.biom" ]
+    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_greengenes_annotation_id_${identityThreshold}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_greengenes_id_${identityThreshold}.biom" ]
     then
-        say "Build blast-findley biom"
+        say "Build vsearch-greengenes biom"
         start_time=$(timer)
-        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_findley_eval_${evalueTaxAnnot}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_findley_annotation_eval_${evalueTaxAnnot}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
-        check_file ${resultDir}/${ProjectName}_findley_eval_${evalueTaxAnnot}.biom
-        say "Elapsed time to build blast-findley biom: $(timer $start_time)"
+        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_greengenes_id_${identityThreshold}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_greengenes_annotation_id_${identityThreshold}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
+        check_file ${resultDir}/${ProjectName}_greengenes_id_${identityThreshold}.biom
+        say "Elapsed time to build vsearch-greengenes biom: $(timer $start_time)"
     fi
-    # UNITE
-    if [ ! -f "${resultDir}/${ProjectName}_vs_unite_id_${identityThreshold}.tsv" ] && [ "$blast_tax" -eq "0" ] && [ "$fungi" -eq "1" ]
+    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_greengenes_annotation_eval_${evalueTaxAnnot}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_greengenes_eval_${evalueTaxAnnot}.biom" ]
     then
-        say "Assign taxonomy against unite with vsearch"
+        say "Build blast-greengenes biom"
         start_time=$(timer)
-        $vsearch --usearch_global ${resultDir}/${ProjectName}_otu.fasta --db $unite --id $identityThreshold --blast6out ${resultDir}/${ProjectName}_vs_unite_id_${identityThreshold}.tsv --strand both
-        #check_file ${resultDir}/${ProjectName}_vs_unite_id_${identityThreshold}.tsv
-        say "Elapsed time with vsearch: $(timer $start_time)"
+        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_greengenes_eval_${evalueTaxAnnot}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_greengenes_annotation_eval_${evalueTaxAnnot}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
+        check_file ${resultDir}/${ProjectName}_greengenes_eval_${evalueTaxAnnot}.biom
+        say "Elapsed time to build blast-greengenes biom: $(timer $start_time)"
     fi
-    if [ -f "${resultDir}/${ProjectName}_vs_unite_id_${identityThreshold}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_unite_annotation_id_${identityThreshold}.tsv" ]
+    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_findley_annotation_id_${identityThreshold}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_findley_id_${identityThreshold}.biom" ]
     then
-        say "Extract vsearch - unite annotation with get_taxonomy"
+        say "Build vsearch-findley biom"
         start_time=$(timer)
-        python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_unite_id_${identityThreshold}.tsv -d $unite -u  ${resultDir}/${ProjectName}_otu.fasta  -o ${resultDir}/${ProjectName}_vs_unite_annotation_id_${identityThreshold}.tsv -ob ${resultDir}/${ProjectName}_vs_unite_annotation_id_${identityThreshold}.biomtsv -dtype unite
-        #check_file ${resultDir}/${ProjectName}_vs_unite_annotation_id_${identityThreshold}.tsv
-        say "Elapsed time with vsearch: $(timer $start_time)"
+        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_findley_id_${identityThreshold}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_findley_annotation_id_${identityThreshold}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
+        check_file ${resultDir}/${ProjectName}_findley_id_${identityThreshold}.biom
+        say "Elapsed time to build vsearch-findley biom: $(timer $start_time)"
+    fi
+    if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_findley_annotation_eval_${evalueTaxAnnot}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_findley_eval_${evalueTaxAnnot}.biom" ]
+    then
+        say "Build blast-findley biom"
+        start_time=$(timer)
+        $biom add-metadata -i ${resultDir}/${ProjectName}_count.biom -o ${resultDir}/${ProjectName}_findley_eval_${evalueTaxAnnot}.biom --observation-metadata-fp ${resultDir}/${ProjectName}_vs_findley_annotation_eval_${evalueTaxAnnot}.biomtsv --observation-header id,taxonomy --sc-separated taxonomy --output-as-json
+        check_file ${resultDir}/${ProjectName}_findley_eval_${evalueTaxAnnot}.biom
+        say "Elapsed time to build blast-findley biom: $(timer $start_time)"
     fi
     if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_unite_annotation_id_${identityThreshold}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_unite_id_${identityThreshold}.biom" ]
     then
@@ -1094,22 +1141,6 @@ then
         check_file ${resultDir}/${ProjectName}_unite_id_${identityThreshold}.biom
         say "Elapsed time to build vsearch-unite biom: $(timer $start_time)"
     fi
-    if [ ! -f "${resultDir}/${ProjectName}_vs_unite_eval_${evalueTaxAnnot}.tsv" ] && [ "$blast_tax" -eq "1" ] && [ "$fungi" -eq "1" ]
-    then
-         say "Assign taxonomy against unite with blast"
-         start_time=$(timer)
-         $blastn -query ${resultDir}/${ProjectName}_otu.fasta -db $unite -evalue $evalueTaxAnnot -num_threads $NbProc -out ${resultDir}/${ProjectName}_vs_unite_eval_${evalueTaxAnnot}.tsv -max_target_seqs $maxTargetSeqs -task megablast -outfmt "6 qseqid sseqid  pident qcovs evalue" -use_index true
-         #check_file ${resultDir}/${ProjectName}_vs_unite_eval_${evalueTaxAnnot}.tsv
-         say "Elapsed time with blast: $(timer $start_time)"
-    fi
-    if [ -f "${resultDir}/${ProjectName}_vs_unite_eval_${evalueTaxAnnot}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_unite_annotation_eval_${evalueTaxAnnot}.tsv" ]
-    then
-         say "Extract unite annotation with get_taxonomy"
-         start_time=$(timer)
-         python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_unite_eval_${evalueTaxAnnot}.tsv -d $unite -u  ${resultDir}/${ProjectName}_otu.fasta  -o ${resultDir}/${ProjectName}_vs_unite_annotation_eval_${evalueTaxAnnot}.tsv -ob ${resultDir}/${ProjectName}_vs_unite_annotation_eval_${evalueTaxAnnot}.biomtsv -dtype unite
-         #check_file ${resultDir}/${ProjectName}_vs_unite_annotation_eval_${evalueTaxAnnot}.tsv
-         say "Elapsed time with get_taxonomy: $(timer $start_time)"
-    fi
     if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_unite_annotation_eval_${evalueTaxAnnot}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_unite_eval_${evalueTaxAnnot}.biom" ]
     then
          say "Build blast-unite biom"
@@ -1118,23 +1149,6 @@ then
          check_file ${resultDir}/${ProjectName}_unite_eval_${evalueTaxAnnot}.biom
          say "Elapsed time to build blast-unite biom: $(timer $start_time)"
     fi
-    #Underhill
-    if [ ! -f "${resultDir}/${ProjectName}_vs_underhill_id_${identityThreshold}.tsv" ] && [ "$blast_tax" -eq "0" ] && [ "$fungi" -eq "1" ]
-    then
-        say "Assign taxonomy against underhill with vsearch"
-        start_time=$(timer)
-        $vsearch --usearch_global ${resultDir}/${ProjectName}_otu.fasta --db $underhill --id $identityThreshold --blast6out ${resultDir}/${ProjectName}_vs_underhill_id_${identityThreshold}.tsv --strand both
-        #check_file ${resultDir}/${ProjectName}_vs_underhill_id_${identityThreshold}.tsv
-        say "Elapsed time with vsearch: $(timer $start_time)"
-    fi
-    if [ -f "${resultDir}/${ProjectName}_vs_underhill_id_${identityThreshold}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_underhill_annotation_id_${identityThreshold}.tsv" ]
-    then
-        say "Extract vsearch - underhill annotation with get_taxonomy"
-        start_time=$(timer)
-        python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_underhill_id_${identityThreshold}.tsv -d $underhill -u  ${resultDir}/${ProjectName}_otu.fasta -t $underhill_taxonomy   -o ${resultDir}/${ProjectName}_vs_underhill_annotation_id_${identityThreshold}.tsv -ob ${resultDir}/${ProjectName}_vs_underhill_annotation_id_${identityThreshold}.biomtsv -dtype underhill
-        #check_file ${resultDir}/${ProjectName}_vs_underhill_annotation_id_${identityThreshold}.tsv
-        say "Elapsed time with vsearch: $(timer $start_time)"
-    fi
     if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_underhill_annotation_id_${identityThreshold}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_underhill_id_${identityThreshold}.biom" ]
     then
         say "Build vsearch-underhill biom"
@@ -1143,22 +1157,6 @@ then
         check_file ${resultDir}/${ProjectName}_underhill_id_${identityThreshold}.biom
         say "Elapsed time to build vsearch-underhill biom: $(timer $start_time)"
     fi
-    if [ ! -f "${resultDir}/${ProjectName}_vs_underhill_eval_${evalueTaxAnnot}.tsv" ] && [ "$blast_tax" -eq "1" ] && [ "$fungi" -eq "1" ]
-    then
-         say "Assign taxonomy against underhill with blast"
-         start_time=$(timer)
-         $blastn -query ${resultDir}/${ProjectName}_otu.fasta -db $underhill -evalue $evalueTaxAnnot -num_threads $NbProc -out ${resultDir}/${ProjectName}_vs_underhill_eval_${evalueTaxAnnot}.tsv -max_target_seqs $maxTargetSeqs -task megablast -outfmt "6 qseqid sseqid  pident qcovs evalue" -use_index true
-         #check_file ${resultDir}/${ProjectName}_vs_underhill_eval_${evalueTaxAnnot}.tsv
-         say "Elapsed time with blast: $(timer $start_time)"
-    fi
-    if [ -f "${resultDir}/${ProjectName}_vs_underhill_eval_${evalueTaxAnnot}.tsv" ] && [ ! -f "${resultDir}/${ProjectName}_vs_underhill_annotation_eval_${evalueTaxAnnot}.tsv" ]
-    then
-         say "Extract underhill annotation with get_taxonomy"
-         start_time=$(timer)
-         python $get_taxonomy -i ${resultDir}/${ProjectName}_vs_underhill_eval_${evalueTaxAnnot}.tsv -d $underhill -u  ${resultDir}/${ProjectName}_otu.fasta -o ${resultDir}/${ProjectName}_vs_underhill_annotation_eval_${evalueTaxAnnot}.tsv -ob ${resultDir}/${ProjectName}_vs_underhill_annotation_eval_${evalueTaxAnnot}.biomtsv -dtype underhill
-         #check_file ${resultDir}/${ProjectName}_vs_underhill_annotation_eval_${evalueTaxAnnot}.tsv
-         say "Elapsed time with get_taxonomy: $(timer $start_time)"
-    fi
     if [ -f "${resultDir}/${ProjectName}_count.biom" ] && [ -f "${resultDir}/${ProjectName}_vs_underhill_annotation_eval_${evalueTaxAnnot}.biomtsv" ] && [ ! -f "${resultDir}/${ProjectName}_underhill_eval_${evalueTaxAnnot}.biom" ]
     then
          say "Build blast-underhill biom"
@@ -1170,6 +1168,33 @@ then
     ##
     # Phylogenetic analysis
     ##
+    # Extract the OTU annotated by each software in one pass
+    extract_opt=""
+    extract_soft=""
+    for annotation in $(ls  ${resultDir}/${ProjectName}_*_annotation_*.tsv ${resultDir}/${ProjectName}_vs_rdp.tsv)
+    do
+        soft=$(echo $annotation |sed -r "s:.*vs_(.+)_annotation_.*:\1:g" )
+        if [ "$annotation" == "${resultDir}/${ProjectName}_vs_rdp.tsv" ]
+        then
+            soft="rdp"
+        fi
+        if [ "$soft" != "" ] && [ ! -f "${resultDir}/${ProjectName}_otu_${soft}.fasta" ] && [[ " $extract_soft " != *" $soft "* ]]
+        then
+            extract_opt="$extract_opt -i ${annotation}:${resultDir}/${ProjectName}_otu_${soft}.fasta"
+            extract_soft="$extract_soft $soft"
+        fi
+    done
+    if [ -f "${resultDir}/${ProjectName}_otu.fasta" ] && [ "$extract_opt" != "" ]
+    then
+        say "Extract OTU annotated with$extract_soft"
+        start_time=$(timer)
+        python $extract_fasta -x -d ${resultDir}/${ProjectName}_otu.fasta $extract_opt
+        for soft in $extract_soft
+        do
+            check_file ${resultDir}/${ProjectName}_otu_${soft}.fasta
+        done
+        say "Elapsed time with extract_fasta: $(timer $start_time)"
+    fi
     for annotation in $(ls  ${resultDir}/${ProjectName}_*_annotation_*.tsv ${resultDir}/${ProjectName}_vs_rdp.tsv)
     do
         # Ugly
@@ -1183,15 +1208,6 @@ then
             error "Unable to recognize the software for: $annotation"
             exit 1
         fi
-        # Select annotated OTU
-        if [ -f "${resultDir}/${ProjectName}_otu.fasta" ] && [ ! -f "${resultDir}/${ProjectName}_otu_${soft}.fasta" ]
-        then
-            say "Extract OTU annotated with $soft"
-            start_time=$(timer)
-            python $extract_fasta -d ${resultDir}/${ProjectName}_otu.fasta -i $annotation -o ${resultDir}/${ProjectName}_otu_${soft}.fasta
-            check_file ${resultDir}/${ProjectName}_otu_${soft}.fasta
-            say "Elapsed time with extract_fasta: $(timer $start_time)"
-        fi
         # Alignment
         if [ -f "${resultDir}/${ProjectName}_otu_${soft}.fasta" ] && [ ! -f "${resultDir}/${ProjectName}_otu_${soft}.ali" ]
         then
@@ -14,6 +14,13 @@ from __future__ import print_function
 import os
 import sys
 import argparse
+import heapq
+import re
+import shutil
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "fasta_writer"))
+from fasta_writer import FastaWriter, open_fasta_output, read_fasta
 
 __author__ = "Amine Ghozlane"
 __copyright__ = "Copyright 2015, Institut Pasteur"
@@ -52,52 +59,153 @@ def getArguments():
                         help='Relabel name (default= OTU_).')
     parser.add_argument('-o', dest='output_file', type=str, default=None,
                         help='Output file.')
+    parser.add_argument('-m', dest='mapping_file', type=str, default=None,
+                        help='Write the old identifier, the new identifier '
+                        'and the size of each OTU in this tabulated file.')
+    parser.add_argument('-s', dest='sort_size', action='store_true',
+                        default=False, help='Number the OTU by decreasing '
+                        'abundance (;size= annotation, 1 if absent) and write '
+                        'it in the headers.')
+    parser.add_argument('-b', dest='memory', type=int, default=1024,
+                        help='Memory used to sort the OTU in MB, larger '
+                        'inputs are sorted on disk (default = 1024).')
     args = parser.parse_args()
     return args
 
 
-def fill(text, width=80):
-    """Split text"""
-    return os.linesep.join(text[i:i+width] for i in xrange(0, len(text), width))
+def get_size(header):
+    """Get the size annotation of a header, empty if there is none
+    """
+    size = re.search(br";size=(\d+)", header)
+    if size:
+        return size.group(1)
+    return b""
 
 
-def rename_otu(fasta_file, name, output_file):
-    """Add new label and rewrite text
+def rename_otu(fasta_file, name, output_file, mapping_file=None):
+    """Add new label and rewrite text, one record at a time
     """
-    count = 1
-    if not output_file:
-        output = sys.stdout
-    else:
-        output = open(output_file, "wt")
-    header = ""
-    sequence = ""
+    mapping = None
+    try:
+        output = FastaWriter(open_fasta_output(output_file))
+    except IOError:
+        sys.exit("Error cannot open {0}".format(output_file))
+    if mapping_file:
+        try:
+            mapping = open(mapping_file, "wb")
+        except IOError:
+            sys.exit("Error cannot open {0}".format(mapping_file))
+        mapping.write(b"old_id\totu_id\tsize\n")
+    try:
+        with open(fasta_file, "rb") as fast:
+            for count, (header, sequence) in enumerate(read_fasta(fast), 1):
+                otu = "{0}{1}".format(name, count).encode()
+                output.write(otu, sequence)
+                if mapping:
+                    old_id = header.split(None, 1)[0] if header else b""
+                    mapping.write(b"\t".join((old_id, otu, get_size(header)))
+                                  + b"\n")
+    except IOError:
+        sys.exit("Error cannot open {0}".format(fasta_file))
+    output.close()
+    if mapping:
+        mapping.close()
+
+
+def write_run(records, tmp_dir, num):
+    """Write a sorted part of the OTU in a temporary file
+    """
+    records.sort()
+    run_file = os.path.join(tmp_dir, "run_{0}.txt".format(num))
+    with open(run_file, "wb") as run:
+        for size, order, old_id, sequence in records:
+            run.write(b"\t".join((str(size).encode(), str(order).encode(),
+                                  old_id, sequence)) + b"\n")
+    return run_file
+
+
+def read_run(run_file):
+    """Read back a sorted part of the OTU
+    """
+    with open(run_file, "rb") as run:
+        for line in run:
+            size, order, old_id, sequence = line.rstrip(b"\n").split(b"\t")
+            yield int(size), int(order), old_id, sequence
+
+
+def sort_otu(fasta_file, memory, tmp_dir):
+    """Sort the OTU by decreasing abundance then by order in the file,
+    by parts of memory bytes merged from temporary files when the input
+    does not fit
+      Returns: An iterator over (-size, order, old identifier, sequence)
+    """
+    records = []
+    run_files = []
+    used = 0
+    with open(fasta_file, "rb") as fast:
+        for order, (header, sequence) in enumerate(read_fasta(fast)):
+            size = int(get_size(header) or 1)
+            old_id = header.split(None, 1)[0] if header else b""
+            records.append((-size, order, old_id, bytes(sequence)))
+            # Approximate footprint of the record
+            used += len(sequence) + len(old_id) + 200
+            if used >= memory:
+                run_files.append(write_run(records, tmp_dir, len(run_files)))
+                records = []
+                used = 0
+    if not run_files:
+        records.sort()
+        return iter(records)
+    if records:
+        run_files.append(write_run(records, tmp_dir, len(run_files)))
+    return heapq.merge(*[read_run(run_file) for run_file in run_files])
+
+
+def rename_sorted_otu(fasta_file, name, output_file, mapping_file=None,
+                      memory=1024 << 20):
+    """Number the OTU by decreasing abundance and write their size
+    """
+    mapping = None
     try:
-        with open(fasta_file, "rt") as fast:
-            for line in fast:
-                if line.startswith(">"):
-                    if len(header) > 0:
-                        print(">{0}{1}{2}{3}".format(name, count, os.linesep,
-                                                     fill(sequence)),
-                              file=output)
-                        sequence = ""
-                        count +=1
-                    header = line
-                else:
-                    sequence += line.replace("\n", "").replace("\r", "")
-            print(">{0}{1}{2}{3}".format(name, count, os.linesep,
-                                                     fill(sequence)),
-                  file=output)
+        output = FastaWriter(open_fasta_output(output_file))
+    except IOError:
+        sys.exit("Error cannot open {0}".format(output_file))
+    if mapping_file:
+        try:
+            mapping = open(mapping_file, "wb")
+        except IOError:
+            sys.exit("Error cannot open {0}".format(mapping_file))
+        mapping.write(b"old_id\totu_id\tsize\n")
+    tmp_dir = tempfile.mkdtemp(
+        prefix="rename_otu_",
+        dir=os.path.dirname(os.path.abspath(output_file or fasta_file)))
+    try:
+        for count, (size, _, old_id, sequence) in enumerate(
+                sort_otu(fasta_file, memory, tmp_dir), 1):
+            otu = "{0}{1}".format(name, count).encode()
+            size = str(-size).encode()
+            output.write(otu + b";size=" + size, sequence)
+            if mapping:
+                mapping.write(b"\t".join((old_id, otu, size)) + b"\n")
     except IOError:
         sys.exit("Error cannot open {0}".format(fasta_file))
-    if output_file:
-        output.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    output.close()
+    if mapping:
+        mapping.close()
 
 
 def main():
     """Main program
     """
     args = getArguments()
-    rename_otu(args.fasta_file, args.name, args.output_file)
+    if args.sort_size:
+        rename_sorted_otu(args.fasta_file, args.name, args.output_file,
+                          args.mapping_file, args.memory << 20)
+    else:
+        rename_otu(args.fasta_file, args.name, args.output_file,
+                   args.mapping_file)
 
 
 if __name__ == '__main__':
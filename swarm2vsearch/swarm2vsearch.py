@@ -14,7 +14,31 @@ from __future__ import print_function
 import os
 import sys
 import argparse
+import collections
 import csv
+import datetime
+import json
+import multiprocessing
+import struct
+from array import array
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "fasta_writer"))
+from fasta_writer import read_fasta
+try:
+    COMPLEMENT = bytes.maketrans(b"ACGTUN", b"TGCAAN")
+except AttributeError:
+    import string
+    COMPLEMENT = string.maketrans("ACGTUN", "TGCAAN")
+
+
+# Size of the parts of the uclust file rewritten at once
+BLOCK_SIZE = 8 << 20
+# Seed name to OTU name lookup used by the uclust rewrite processes
+UCLUST_LOOKUP = {}
+# First bytes of the OTU offset index of a clustering file
+INDEX_MAGIC = b"OTUIDX1\n"
+# Header annotations giving the sample of an amplicon
+SAMPLE_TAGS = (b"barcodelabel=", b"sample=")
 
 def isfile(path):
     """Check if path is an existing file.
@@ -64,49 +88,242 @@ def getArguments():
                         default=None, help='Output clustering file.')
     parser.add_argument('-ou', dest='output_uclust_file', type=str,
                         default=None, help='Output uclust file.')
+    parser.add_argument('-oi', dest='output_index_file', type=str,
+                        default=None, help='Output binary index of the '
+                        'byte offset of each OTU in the output clustering '
+                        'file.')
+    parser.add_argument('-a', dest='amplicon_file', type=isfile,
+                        default=None, help='Path to the amplicons of all '
+                        'the samples (fasta with barcodelabel=sample), used '
+                        'to count the reads of each OTU.')
+    parser.add_argument('-d', dest='dereplicated_file', type=isfile,
+                        default=None, help='Path to the dereplicated '
+                        'amplicons clustered by swarm.')
+    parser.add_argument('-ot', dest='output_table_file', type=str,
+                        default=None, help='Output OTU table (tsv).')
+    parser.add_argument('-ob', dest='output_biom_file', type=str,
+                        default=None, help='Output OTU table (biom).')
+    parser.add_argument('-t', dest='threads', type=int, default=1,
+                        help='Number of processes used to rewrite the uclust '
+                        'file (default = 1).')
+    parser.add_argument('-s', dest='stream', action='store_true',
+                        default=False, help='Write the output clustering '
+                        'file while the swarm clustering file is read, '
+                        'only the seeds are kept in memory (requires -oc).')
     parser.add_argument('-r', dest='results', type=isdir,
                         default=os.curdir + os.sep,
                         help='Path to result directory.')
     args = parser.parse_args()
+    if args.stream and not args.output_clustering_file:
+        parser.error("-s requires -oc")
+    if args.output_index_file and not args.output_clustering_file:
+        parser.error("-oi requires -oc")
+    if ((args.output_table_file or args.output_biom_file) and
+            not (args.amplicon_file and args.dereplicated_file)):
+        parser.error("-ot and -ob require -a and -d")
     return args
 
 
-def get_cluster(clustering_file):
+def strip_size(name):
+    """Remove the ";size=N;" annotation of an amplicon name
+    """
+    parts = name.rsplit(";", 2)
+    if len(parts) == 3:
+        return parts[0]
+    return ""
+
+
+class SeedIndex(object):
+    """OTU number of the seed of each swarm cluster.
+    """
+    def __init__(self):
+        # Seed name to cluster index
+        self.seeds = {}
+        self.nb_cluster = 0
+
+    def __len__(self):
+        return self.nb_cluster
+
+    def add(self, members):
+        """Add the next cluster, its seed first
+        """
+        if members[0] in self.seeds:
+            raise ValueError("{0} is the seed of several clusters".format(
+                members[0]))
+        self.seeds[members[0]] = self.nb_cluster
+        self.nb_cluster += 1
+
+    def get_otu(self, seed):
+        """Get the OTU name of a seed
+        """
+        return "OTU_{0}".format(self.seeds[seed] + 1)
+
+
+class ClusterIndex(SeedIndex):
+    """Swarm clusters in OTU order. Member names are stored in a single
+    buffer and only decoded when they are written.
     """
+    def __init__(self):
+        SeedIndex.__init__(self)
+        # Concatenated member names and end offset of each name
+        self.names = bytearray()
+        self.name_ends = array("L")
+        # Index of the first member of the next cluster, for each cluster
+        self.cluster_ends = array("I")
+
+    def add(self, members):
+        """Add the next cluster, its seed first
+        """
+        SeedIndex.add(self, members)
+        for name in members:
+            self.names += name.encode()
+            self.name_ends.append(len(self.names))
+        self.cluster_ends.append(len(self.name_ends))
+
+    def get_members(self, num):
+        """Get the member names of a cluster, its seed first
+        """
+        first = self.cluster_ends[num - 1] if num else 0
+        start = self.name_ends[first - 1] if first else 0
+        members = []
+        for end in self.name_ends[first:self.cluster_ends[num]]:
+            members.append(self.names[start:end].decode())
+            start = end
+        return members
+
+
+def get_cluster(clustering_file):
+    """Read the swarm clusters, one per line
     """
-    cluster_dict = {}
+    cluster_index = ClusterIndex()
     try:
         with open(clustering_file, "rt") as clustering:
-            clustering_reader = csv.reader(clustering, delimiter=' ')
-            for i,cluster in enumerate(clustering_reader):
-                cluster_dict[";".join(cluster[0].split(";")[:-2])] = (
-                    ["OTU_{0}".format(i + 1),
-                     [";".join(value.split(";")[:-2]) for value in cluster]])
-        assert(len(cluster_dict) > 0)
+            for line in clustering:
+                members = [strip_size(value) for value in line.split()]
+                if members:
+                    cluster_index.add(members)
+        assert(len(cluster_index) > 0)
     except IOError:
         sys.exit("Error cannot open {0}".format(clustering_file))
+    except ValueError as err:
+        sys.exit("Error in {0}: {1}".format(clustering_file, err))
     except AssertionError:
         sys.exit("Error no element read from {0}".format(clustering_file))
-    return cluster_dict
+    return cluster_index
+
+
+class ClusteringWriter(object):
+    """Write the OTU clustering table in OTU order, and optionally the
+    byte offset of each OTU row in a binary index: INDEX_MAGIC, the number
+    of OTU then the offsets of the rows of OTU_1 to OTU_n and the end of
+    the file, as little-endian unsigned 64-bit integers. The index needs
+    the OTU order, the rows followed the order of the seed dict before.
+    """
+    def __init__(self, output_clustering_file, index_file=None):
+        self.output_clustering = open(output_clustering_file, "wb")
+        self.index_file = index_file
+        self.offsets = array("L") if index_file else None
+        self.position = 0
+        self.rows = []
+        # The csv writer fills rows, lines are written by write_row
+        self.writer = csv.writer(self, delimiter='\t')
+        self.write_row(["OTU", "OTU_representant", "OTU_cluster"])
 
+    def write(self, text):
+        """Receive a line from the csv writer
+        """
+        self.rows.append(text)
 
-def set_cluster(cluster_dict, output_clustering_file):
+    def write_row(self, row):
+        """Write a line of the clustering table
+        """
+        self.writer.writerow(row)
+        line = "".join(self.rows).encode()
+        self.rows = []
+        self.output_clustering.write(line)
+        self.position += len(line)
+
+    def add_otu(self, num, members):
+        """Write the members of the next OTU, its seed first
+        """
+        if self.offsets is not None:
+            self.offsets.append(self.position)
+        self.write_row(["OTU_{0}".format(num + 1), members[0],
+                        " ".join(members)])
+
+    def close(self):
+        """Close the table and write the index
+        """
+        self.output_clustering.close()
+        if self.index_file:
+            self.offsets.append(self.position)
+            with open(self.index_file, "wb") as index:
+                index.write(INDEX_MAGIC)
+                index.write(struct.pack("<Q", len(self.offsets) - 1))
+                for start in range(0, len(self.offsets), 65536):
+                    chunk = self.offsets[start:start + 65536]
+                    index.write(struct.pack("<{0}Q".format(len(chunk)),
+                                            *chunk))
+
+
+def get_otu_row(output_clustering_file, index_file, num):
+    """Read the clustering row of OTU_num with the index, without parsing
+    the whole table
+      Returns: The OTU name, its representant and the list of its members
     """
+    with open(index_file, "rb") as index:
+        if index.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError("{0} is not an OTU index".format(index_file))
+        nb_otu = struct.unpack("<Q", index.read(8))[0]
+        if not 1 <= num <= nb_otu:
+            raise ValueError("OTU_{0} is not in {1}".format(num, index_file))
+        index.seek(len(INDEX_MAGIC) + 8 * num)
+        start, end = struct.unpack("<2Q", index.read(16))
+    with open(output_clustering_file, "rb") as clustering:
+        clustering.seek(start)
+        row = clustering.read(end - start).decode().rstrip("\r\n")
+    otu, representant, members = row.split("\t")
+    return otu, representant, members.split(" ")
+
+
+def stream_cluster(clustering_file, output_clustering_file, index_file=None):
+    """Write the members of each OTU while the swarm clusters are read,
+    only the seeds are kept
     """
+    seed_index = SeedIndex()
     try:
-        with open(output_clustering_file, "wt") as output_clustering:
-            output_clustering_writer = csv.writer(output_clustering,
-                                                  delimiter='\t')
-            output_clustering_writer.writerow(["OTU", "OTU_representant",
-                                               "OTU_cluster"])
-            for cluster in cluster_dict:
-                output_clustering_writer.writerow([cluster_dict[cluster][0],
-                                                   cluster, " ".join(cluster_dict[cluster][1])])
-    except IOError:
-        sys.exit("Error cannot open {0}".format(output_clustering_file))
+        with open(clustering_file, "rt") as clustering:
+            output = ClusteringWriter(output_clustering_file, index_file)
+            for line in clustering:
+                members = [strip_size(value) for value in line.split()]
+                if members:
+                    seed_index.add(members)
+                    output.add_otu(len(seed_index) - 1, members)
+            output.close()
+        assert(len(seed_index) > 0)
+    except IOError as err:
+        sys.exit("Error cannot open {0}".format(err.filename))
+    except ValueError as err:
+        sys.exit("Error in {0}: {1}".format(clustering_file, err))
+    except AssertionError:
+        sys.exit("Error no element read from {0}".format(clustering_file))
+    return seed_index
 
 
-def convert_swarm_fasta(input_file, cluster_dict, output_file):
+def set_cluster(cluster_index, output_clustering_file, index_file=None):
+    """Write the members of each OTU, in OTU order instead of the order of
+    the seed dict (hash order with Python 2)
+    """
+    try:
+        output = ClusteringWriter(output_clustering_file, index_file)
+        for num in range(len(cluster_index)):
+            output.add_otu(num, cluster_index.get_members(num))
+        output.close()
+    except IOError as err:
+        sys.exit("Error cannot open {0}".format(err.filename))
+
+
+def convert_swarm_fasta(input_file, cluster_index, output_file):
     """
     """
     clust_header = ""
@@ -125,7 +342,7 @@ def convert_swarm_fasta(input_file, cluster_dict, output_file):
                                 sequence.upper().replace("\n","")),
                               file=output)
                     header = ";".join(line[1:].replace("\n","").split(";")[:-2])
-                    clust_header = cluster_dict[header][0]
+                    clust_header = cluster_index.get_otu(header)
                     sequence = ""
                 elif len(line) > 0 and header:
                     sequence += line
@@ -137,38 +354,271 @@ def convert_swarm_fasta(input_file, cluster_dict, output_file):
         sys.exit("Error cannot open {0}".format(input_file))
 
 
-def convert_swarm_uclust(uclust_file, cluster_dict, output_uclust_file):
+def read_line_blocks(handle, size=BLOCK_SIZE):
+    """Read a file by blocks made of complete lines
+    """
+    tail = b""
+    block = handle.read(size)
+    while block:
+        end = block.rfind(b"\n") + 1
+        if end:
+            yield tail + block[:end]
+            tail = block[end:]
+        else:
+            tail += block
+        block = handle.read(size)
+    if tail:
+        yield tail
+
+
+def set_uclust_lookup(lookup):
+    """Share the seed to OTU lookup with a rewrite process
+    """
+    global UCLUST_LOOKUP
+    UCLUST_LOOKUP = lookup
+
+
+def rewrite_uclust_block(block):
+    """Replace the target of each uclust line (10th column) by its OTU
     """
+    lookup = UCLUST_LOOKUP
+    lines = block.split(b"\n")
+    for i, line in enumerate(lines):
+        fields = line.split(b"\t", 9)
+        if len(fields) == 10:
+            target = fields[9].rstrip(b"\r")
+            if target != b"*":
+                parts = target.rsplit(b";", 2)
+                seed = parts[0] if len(parts) == 3 else b""
+                try:
+                    # Keep the "\r" of CRLF lines
+                    fields[9] = lookup[seed] + fields[9][len(target):]
+                except KeyError:
+                    raise ValueError("Unknown seed {0}".format(
+                        target.decode()))
+                lines[i] = b"\t".join(fields)
+    return b"\n".join(lines)
+
+
+def convert_swarm_uclust(uclust_file, cluster_index, output_uclust_file,
+                         threads=1):
+    """Rewrite the target column of the uclust file by blocks of lines,
+    with a pool of processes if threads > 1
     """
+    lookup = dict((seed.encode(), "OTU_{0}".format(num + 1).encode())
+                  for seed, num in cluster_index.seeds.items())
     if not output_uclust_file:
-        output = sys.stdout
+        output = getattr(sys.stdout, "buffer", sys.stdout)
     else:
-        output = open(output_uclust_file, "wt")
+        output = open(output_uclust_file, "wb")
+    pool = None
     try:
-        with open(uclust_file, "rt") as uclust:
-            uclust_reader = csv.reader(uclust, delimiter="\t")
-            for line in uclust_reader:
-                if line[9] != "*":
-                    line[9] = cluster_dict[";".join(line[9].split(";")[:-2])][0]
-                print("\t".join(line), file=output)
+        with open(uclust_file, "rb") as uclust:
+            blocks = read_line_blocks(uclust)
+            if threads > 1:
+                pool = multiprocessing.Pool(threads,
+                                            initializer=set_uclust_lookup,
+                                            initargs=(lookup,))
+                pending = collections.deque()
+                for block in blocks:
+                    pending.append(pool.apply_async(rewrite_uclust_block,
+                                                    (block,)))
+                    # Keep the output order and bound the memory
+                    if len(pending) > 2 * threads:
+                        output.write(pending.popleft().get())
+                while pending:
+                    output.write(pending.popleft().get())
+                pool.close()
+                pool.join()
+            else:
+                set_uclust_lookup(lookup)
+                for block in blocks:
+                    output.write(rewrite_uclust_block(block))
     except IOError:
         sys.exit("Error cannot open {0}".format(uclust_file))
+    except ValueError as err:
+        sys.exit("Error in {0}: {1}".format(uclust_file, err))
+    finally:
+        if pool:
+            pool.terminate()
+    if output_uclust_file:
+        output.close()
+
+
+def get_member_otu(clustering_file):
+    """Get the OTU number of each amplicon of the swarm clusters
+    """
+    member_otu = {}
+    num = 0
+    try:
+        with open(clustering_file, "rb") as clustering:
+            for line in clustering:
+                members = line.split()
+                if members:
+                    for name in members:
+                        parts = name.rsplit(b";", 2)
+                        member_otu[parts[0] if len(parts) == 3 else b""] = num
+                    num += 1
+    except IOError:
+        sys.exit("Error cannot open {0}".format(clustering_file))
+    return member_otu, num
+
+
+def get_key(sequence):
+    """Get the same key for a sequence and its reverse complement
+    """
+    sequence = sequence.upper()
+    reverse = sequence.translate(COMPLEMENT)[::-1]
+    return min(sequence, reverse)
+
+
+def get_sequence_otu(dereplicated_file, member_otu):
+    """Get the OTU number of each dereplicated sequence
+    """
+    sequence_otu = {}
+    try:
+        with open(dereplicated_file, "rb") as fasta:
+            for header, sequence in read_fasta(fasta):
+                parts = header.split(None, 1)[0].rsplit(b";", 2)
+                name = parts[0] if len(parts) == 3 else b""
+                if name in member_otu:
+                    sequence_otu[get_key(sequence)] = member_otu[name]
+    except IOError:
+        sys.exit("Error cannot open {0}".format(dereplicated_file))
+    return sequence_otu
+
+
+def get_annotations(header):
+    """Get the sample and the number of reads of an amplicon
+    """
+    sample = b""
+    size = 1
+    for field in header.split(None, 1)[0].split(b";"):
+        if field.startswith(SAMPLE_TAGS):
+            sample = field.partition(b"=")[2]
+        elif field.startswith(b"size="):
+            size = int(field[5:])
+    return sample, size
+
+
+def count_otu(amplicon_file, sequence_otu):
+    """Count the reads of each sample in each OTU, the amplicons are
+    assigned by exact match to the dereplicated sequences
+      Returns: A dict of Counter of the reads of each sample by OTU, the
+               number of assigned and of unassigned reads
+    """
+    counts = collections.defaultdict(collections.Counter)
+    samples = set()
+    assigned = 0
+    unassigned = 0
+    try:
+        with open(amplicon_file, "rb") as fasta:
+            for header, sequence in read_fasta(fasta):
+                sample, size = get_annotations(header)
+                samples.add(sample)
+                otu = sequence_otu.get(get_key(sequence))
+                if otu is None:
+                    unassigned += size
+                else:
+                    counts[otu][sample] += size
+                    assigned += size
+    except IOError:
+        sys.exit("Error cannot open {0}".format(amplicon_file))
+    except ValueError as err:
+        sys.exit("Error in {0}: {1}".format(amplicon_file, err))
+    return counts, sorted(samples), assigned, unassigned
+
+
+def write_otu_table(counts, samples, nb_otu, output_table_file):
+    """Write the OTU table in the vsearch --otutabout format
+    """
+    try:
+        with open(output_table_file, "wt") as output:
+            output.write("#OTU ID\t{0}\n".format(
+                "\t".join(sample.decode() for sample in samples)))
+            for num in range(nb_otu):
+                otu_counts = counts.get(num, {})
+                output.write("OTU_{0}\t{1}\n".format(num + 1, "\t".join(
+                    str(otu_counts.get(sample, 0)) for sample in samples)))
+    except IOError:
+        sys.exit("Error cannot open {0}".format(output_table_file))
+
+
+def write_otu_biom(counts, samples, nb_otu, output_biom_file):
+    """Write the OTU table in the biom 1.0 (json) format
+    """
+    sample_index = dict((sample, i) for i, sample in enumerate(samples))
+    data = []
+    for num in range(nb_otu):
+        for sample, count in sorted(counts.get(num, {}).items()):
+            data.append([num, sample_index[sample], count])
+    biom = collections.OrderedDict([
+        ("id", None),
+        ("format", "Biological Observation Matrix 1.0.0"),
+        ("format_url", "http://biom-format.org"),
+        ("type", "OTU table"),
+        ("generated_by", "swarm2vsearch"),
+        ("date", datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")),
+        ("rows", [{"id": "OTU_{0}".format(num + 1), "metadata": None}
+                  for num in range(nb_otu)]),
+        ("columns", [{"id": sample.decode(), "metadata": None}
+                     for sample in samples]),
+        ("matrix_type", "sparse"),
+        ("matrix_element_type", "int"),
+        ("shape", [nb_otu, len(samples)]),
+        ("data", data)])
+    try:
+        with open(output_biom_file, "wt") as output:
+            json.dump(biom, output, separators=(",", ":"))
+            output.write("\n")
+    except IOError:
+        sys.exit("Error cannot open {0}".format(output_biom_file))
+
+
+def build_otu_table(clustering_file, dereplicated_file, amplicon_file,
+                    output_table_file, output_biom_file):
+    """Build the OTU table by joining the swarm clusters, the dereplicated
+    sequences and the amplicons of each sample
+    """
+    member_otu, nb_otu = get_member_otu(clustering_file)
+    sequence_otu = get_sequence_otu(dereplicated_file, member_otu)
+    del member_otu
+    counts, samples, assigned, unassigned = count_otu(amplicon_file,
+                                                      sequence_otu)
+    print("{0} reads assigned to {1} OTU, {2} reads not assigned".format(
+        assigned, nb_otu, unassigned), file=sys.stderr)
+    if output_table_file:
+        write_otu_table(counts, samples, nb_otu, output_table_file)
+    if output_biom_file:
+        write_otu_biom(counts, samples, nb_otu, output_biom_file)
 
 
 def main():
     """Main program
     """
     args = getArguments()
-    # Read clustering
-    cluster_dict = get_cluster(args.clustering_file)
-    # Assign OTU number to each cluster
-    set_cluster(cluster_dict, args.output_clustering_file)
-    #print(cluster_dict)
+    if args.stream:
+        # Assign OTU number to each cluster while reading the clustering
+        cluster_index = stream_cluster(args.clustering_file,
+                                       args.output_clustering_file,
+                                       args.output_index_file)
+    else:
+        # Read clustering
+        cluster_index = get_cluster(args.clustering_file)
+        # Assign OTU number to each cluster
+        set_cluster(cluster_index, args.output_clustering_file,
+                    args.output_index_file)
     # Reassign fasta file
-    convert_swarm_fasta(args.input_file, cluster_dict, args.output_file)
+    convert_swarm_fasta(args.input_file, cluster_index, args.output_file)
     # Reassign uclust file
     if args.uclust_file:
-        convert_swarm_uclust(args.uclust_file, cluster_dict, args.output_uclust_file)
+        convert_swarm_uclust(args.uclust_file, cluster_index,
+                             args.output_uclust_file, args.threads)
+    # Count the reads of each sample by OTU
+    if args.output_table_file or args.output_biom_file:
+        build_otu_table(args.clustering_file, args.dereplicated_file,
+                        args.amplicon_file, args.output_table_file,
+                        args.output_biom_file)
 
 
 if __name__ == '__main__':